@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Headless benchmark of the editor hot paths on generated Python files.
+
+Loads files from 100 to 50,000 lines in a PythonEditor with a PythonHighlighter
+and times loading, opening as the file browser does, typing, magic typing, autocomplete, scrolling and a full
+rehighlight, in milliseconds. The JSON report can be compared across commits:
+
+    python benchmarks/bench_editor.py --sizes 100 1000 10000 50000 --json editor.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+
+from common import stats, timed, peak_rss_mb, git_commit
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+TEMPLATE = '''class Shape{n}:
+    """A shape with an area, number {n}."""
+
+    def __init__(self, width, height):
+        self.width = width  # in pixels
+        self.height = height
+
+    def area(self):
+        return self.width * self.height
+
+
+def process_{n}(items):
+    result = [item * 2 for item in items if item % 2 == 0]
+    for i in range(len(result)):
+        if result[i] > 10 and not result[i] in (3, 5):
+            print("big value", result[i], 'at', i)
+    return result
+
+'''
+
+
+def make_code(lines):
+    code, n = [], 0
+    while len(code) < lines:
+        code += TEMPLATE.format(n=n).split("\n")[:-1]
+        n += 1
+    return "\n".join(code[:lines]) + "\n"
+
+
+def wait_highlighting(app, editor):
+    while editor.highlighter.timer.isActive():
+        app.processEvents()
+
+
+def bench_size(app, lines, keystrokes, scroll_steps):
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QTextCursor
+    from PyQt5.QtTest import QTest
+    from spiceditor.highlighter import PythonHighlighter
+    from spiceditor.spice_magic_editor import PythonEditor
+
+    code = make_code(lines)
+    editor = PythonEditor(PythonHighlighter())
+    editor.resize(1000, 800)
+    editor.show()
+    app.processEvents()
+
+    result = {"lines": lines}
+    result["load"] = timed(lambda: (editor.setPlainText(code), app.processEvents()))[0]
+    # Big files are colored in the background after the first paint
+    result["load_colored"] = result["load"] + timed(wait_highlighting, app, editor)[0]
+    result["rehighlight"] = timed(editor.highlighter.rehighlight)[0]
+
+    # Opening from the file browser, as MainWindow.file_clicked does, in dark mode
+    result["open"] = timed(lambda: (editor.set_code(code), editor.show_all_code(), editor.set_dark_mode(True),
+                                    app.processEvents()))[0]
+    result["open_colored"] = result["open"] + timed(wait_highlighting, app, editor)[0]
+
+    # Typing in the middle of the file
+    cursor = editor.textCursor()
+    cursor.setPosition(len(code) // 2)
+    editor.setTextCursor(cursor)
+    text = "value = compute(value) + 1"
+    typing = []
+    for i in range(keystrokes):
+        typing.append(timed(lambda: (QTest.keyClick(editor, text[i % len(text)]), app.processEvents()))[0])
+    result["typing"] = stats(typing)
+
+    # Tab on a partial word, candidates are collected from the whole document
+    completion = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(min(keystrokes, 20)):
+            editor.moveCursor(QTextCursor.End)
+            editor.insertPlainText("\npro")
+            editor.suggestion = None
+            completion.append(timed(lambda: (editor.tab_pressed(), app.processEvents()))[0])
+    result["autocomplete"] = stats(completion)
+
+    # Jumping to random positions, the text and the line numbers are painted again
+    bar = editor.verticalScrollBar()
+    rng = random.Random(0)
+    scrolling = []
+    for _ in range(scroll_steps):
+        value = rng.randrange(bar.maximum() + 1)
+        scrolling.append(timed(lambda: (bar.setValue(value), editor.viewport().repaint(),
+                                        editor.line_number_area2.repaint()))[0])
+    result["scrolling"] = stats(scrolling)
+
+    # Magic mode, the program is revealed one keystroke at a time from half way
+    editor.set_code(code)
+    editor.count = len(code) // 2
+    wait_highlighting(app, editor)
+    magic = []
+    for _ in range(min(keystrokes, 50)):
+        magic.append(timed(lambda: (QTest.keyClick(editor, Qt.Key_A), app.processEvents()))[0])
+    result["magic_typing"] = stats(magic)
+
+    editor.close()
+    editor.deleteLater()
+    app.processEvents()
+    return result
+
+
+def print_report(report):
+    # Single operations in ms, the others are the median of every step
+    print("{:<8} {:>10} {:>10} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "lines", "load", "colored", "rehighlight", "open", "colored", "typing", "complete", "scroll", "magic"))
+    for r in report["sizes"]:
+        print("{:<8} {:>10.1f} {:>10.1f} {:>12.1f} {:>10.1f} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            r["lines"], r["load"], r["load_colored"], r["rehighlight"], r["open"], r["open_colored"],
+            r["typing"]["p50"], r["autocomplete"]["p50"],
+            r["scrolling"]["p50"], r["magic_typing"]["p50"]))
+    if report["peak_rss_mb"] is not None:
+        print("peak RSS: {:.1f} MB".format(report["peak_rss_mb"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000], help="Lines of the files")
+    parser.add_argument("--keystrokes", type=int, default=100, help="Keystrokes to time for each size")
+    parser.add_argument("--scroll-steps", type=int, default=50, help="Scroll positions to time for each size")
+    parser.add_argument("--json", type=str, default=None, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+
+    report = {"commit": git_commit(), "sizes": []}
+    for lines in args.sizes:
+        report["sizes"].append(bench_size(app, lines, args.keystrokes, args.scroll_steps))
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    print_report(report)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
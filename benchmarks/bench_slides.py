@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Headless benchmark of the slides path: rendering, code extraction and navigation.
+
+Generates a synthetic deck and reports timings in milliseconds, for example:
+
+    python benchmarks/bench_slides.py --pages 200 --images 2 --code-boxes 1 --json slides.json
+
+Runs with the offscreen Qt platform and a temporary home, so the caches of
+the user are neither used nor touched.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from common import stats, timed, peak_rss_mb, git_commit
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+CODE = ["def f(x):", "    squares = [i * i for i in range(x)]", "    return sum(squares)", "print(f(10))"]
+
+
+def make_pdf(path, pages, images, code_boxes, seed=0):
+    import fitz  # PyMuPDF
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=960, height=540)
+        page.insert_text((40, 50), f"Slide {i + 1}: list comprehensions and generators", fontsize=28)
+        for n in range(images):
+            # Noise does not compress, the worst case for the renderer
+            samples = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+            pixmap = fitz.Pixmap(fitz.csRGB, 160, 120, samples.tobytes(), False)
+            x = 560 + (n % 2) * 190
+            y = 80 + (n // 2) * 150
+            page.insert_image(fitz.Rect(x, y, x + 180, y + 135), pixmap=pixmap)
+        for n in range(code_boxes):
+            y = 80 + n * 130
+            page.draw_rect(fitz.Rect(40, y, 520, y + 110), color=(1, 0, 1))
+            for k, line in enumerate(CODE):
+                page.insert_text((50 + (16 if line.startswith(" ") else 0), y + 22 + k * 20), line.strip(),
+                                 fontname="cour", fontsize=14)
+    doc.save(path)
+    doc.close()
+
+
+def bench_document(path, zoom):
+    import fitz  # PyMuPDF
+    from spiceditor.page_cache import render_page
+    from spiceditor.slide_index import extract_code_blocks
+
+    render, extract = [], []
+    with fitz.open(path) as doc:
+        for page in doc:
+            render.append(timed(render_page, page, zoom)[0])
+            extract.append(timed(extract_code_blocks, page)[0])
+    return {"pages": len(render), "render": stats(render), "code_extraction": stats(extract)}
+
+
+def bench_slides(path, steps, size):
+    from PyQt5.QtWidgets import QApplication
+    from easyconfig2.easyconfig import EasyConfig2
+
+    app = QApplication.instance() or QApplication([])
+    import spiceditor.resources  # noqa
+    from spiceditor.textract import Slides
+
+    config = EasyConfig2()
+    config.root().addCombobox("tb_orientation", items=["Vertical", "Horizontal"], default=0)
+    config.root().addCombobox("click_to_next", items=["1", "2", "3"], default=0)
+
+    def process():
+        app.processEvents()
+
+    open_time, slides = timed(Slides, config, path, 0)
+    slides.resize(*size)
+    slides.show()
+    process()
+    pages = len(slides.page_map)
+
+    # Flipping forward, where prerendering should give cache hits
+    forward = []
+    for _ in range(min(steps, pages - 1)):
+        forward.append(timed(lambda: (slides.move_to(True), process()))[0])
+        # Leave the renderer some time, as a speaker would
+        time.sleep(0.02)
+        process()
+
+    # Jumping around, mostly cache misses
+    rng = random.Random(0)
+    jumps = [timed(lambda: (slides.go_to(rng.randrange(pages)), process()))[0] for _ in range(steps)]
+
+    # Window resizes, the view rescales at once and the page is rendered again later
+    resize, refresh = [], []
+    for n in range(min(steps, 20)):
+        width, height = size[0] - 200 * (n % 2), size[1] - 100 * (n % 2)
+        resize.append(timed(lambda: (slides.resize(width, height), process()))[0])
+        refresh.append(timed(slides.refresh)[0])
+
+    slides.close_document()
+    slides.deleteLater()
+    process()
+    return {"open": open_time, "navigation_forward": stats(forward), "navigation_jump": stats(jumps),
+            "resize": stats(resize), "refresh": stats(refresh)}
+
+
+def print_report(report):
+    print("{} pages, {} images and {} code boxes per page".format(
+        report["pages"], report["images"], report["code_boxes"]))
+    print("{:<20} {:>8} {:>8} {:>8} {:>8} {:>8}".format("ms", "mean", "p50", "p90", "p99", "max"))
+    for name in ["render", "code_extraction", "navigation_forward", "navigation_jump", "resize", "refresh"]:
+        s = report[name]
+        if s:
+            print("{:<20} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+                name, s["mean"], s["p50"], s["p90"], s["p99"], s["max"]))
+    print("open: {:.1f} ms, peak RSS: {} MB".format(
+        report["open"], "n/a" if report["peak_rss_mb"] is None else "{:.1f}".format(report["peak_rss_mb"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pages", type=int, default=100, help="Pages of the synthetic deck")
+    parser.add_argument("--images", type=int, default=1, help="Images per page")
+    parser.add_argument("--code-boxes", type=int, default=1, help="Magenta code boxes per page")
+    parser.add_argument("--steps", type=int, default=50, help="Navigation steps to time")
+    parser.add_argument("--zoom", type=float, default=2, help="Zoom of the render benchmark")
+    parser.add_argument("--size", type=int, nargs=2, default=[1280, 720], help="Size of the slides window")
+    parser.add_argument("--pdf", type=str, default=None, help="Benchmark this PDF instead of a synthetic one")
+    parser.add_argument("--json", type=str, default=None, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Caches and annotations go to ~/.spiceditor, it must be set before importing spiceditor
+        os.environ["HOME"] = tmp
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "deck.pdf")
+            make_pdf(path, args.pages, args.images, args.code_boxes)
+
+        report = {"commit": git_commit(), "pages": args.pages, "images": args.images, "code_boxes": args.code_boxes}
+        report.update(bench_document(path, args.zoom))
+        report.update(bench_slides(path, args.steps, args.size))
+        report["peak_rss_mb"] = peak_rss_mb()
+
+    print_report(report)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ setup(
     install_requires=[
         'pyqt5',
         'pymupdf >= 1.18.17',
+        'numpy',
         'autopep8',
         'scipy',
         'qtconsole',
@@ -0,0 +1,340 @@
+import base64
+import hashlib
+import json
+import math
+import os
+
+import fitz  # PyMuPDF
+import numpy as np
+from PyQt5.QtCore import Qt, QRectF, QPointF
+from PyQt5.QtGui import QPen, QPolygonF, QPainterPath, QPainterPathStroker, QColor
+from PyQt5.QtWidgets import QGraphicsItem, QGraphicsRectItem, QGraphicsEllipseItem
+from scipy.signal import savgol_filter
+
+from spiceditor.worker import QueueWorker
+
+ANNOTATIONS_DIR = os.path.join(os.path.expanduser("~"), ".spiceditor", "annotations")
+
+
+def smooth_with_savgol(points, window_size=10, poly_order=2):
+    if len(points) < window_size:
+        return points
+    # Both coordinates are filtered in a single call
+    return savgol_filter(points, window_size, poly_order, axis=0)
+
+
+def simplify(points, tolerance):
+    """Ramer-Douglas-Peucker simplification of an (N, 2) array of points."""
+    if len(points) < 3:
+        return points
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last] - start
+        dx, dy = end - start
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(dx * inner[:, 1] - dy * inner[:, 0]) / norm
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            farthest += first + 1
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return points[keep]
+
+
+def to_polygon(points):
+    polygon = QPolygonF()
+    if len(points) == 0:
+        return polygon
+    polygon.fill(QPointF(), len(points))
+    # Copy the points straight into the memory of the polygon
+    buffer = polygon.data()
+    buffer.setsize(len(points) * 2 * 8)
+    np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+class Stroke(QGraphicsItem):
+    """A handwritten stroke: one scene item holding all of its points in an (N, 2) array."""
+
+    def __init__(self, pen, point):
+        super().__init__()
+        self.ink = QPen(pen)
+        self.ink.setCapStyle(Qt.RoundCap)
+        self.ink.setJoinStyle(Qt.RoundJoin)
+        self.buffer = np.empty((64, 2))
+        self.buffer[0] = point.x(), point.y()
+        self.count = 1
+        self.bounds = QRectF(point, point)
+        self.polyline = None
+        self.outline = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def points(self):
+        return self.buffer[:self.count]
+
+    def pen(self):
+        return self.ink
+
+    def margin(self):
+        return self.ink.widthF() / 2 + 1
+
+    def add_point(self, point):
+        if self.count == len(self.buffer):
+            self.buffer = np.concatenate([self.buffer, np.empty_like(self.buffer)])
+        last = QPointF(*self.buffer[self.count - 1])
+        self.buffer[self.count] = point.x(), point.y()
+        self.count += 1
+        self.polyline = None
+        self.outline = None
+
+        segment = QRectF(last, point).normalized()
+        if not self.bounds.contains(segment):
+            self.prepareGeometryChange()
+            self.bounds = self.bounds.united(segment)
+
+        # Only the new segment needs to be repainted
+        m = self.margin()
+        self.update(segment.adjusted(-m, -m, m, m))
+
+    def set_points(self, points):
+        self.prepareGeometryChange()
+        self.buffer = np.array(points, dtype=np.float64).reshape(-1, 2)
+        self.count = len(self.buffer)
+        x0, y0 = self.buffer.min(axis=0)
+        x1, y1 = self.buffer.max(axis=0)
+        self.bounds = QRectF(x0, y0, x1 - x0, y1 - y0)
+        self.polyline = None
+        self.outline = None
+        self.update()
+
+    def polygon(self):
+        if self.polyline is None:
+            self.polyline = to_polygon(self.points)
+        return self.polyline
+
+    def boundingRect(self):
+        m = self.margin()
+        return self.bounds.adjusted(-m, -m, m, m)
+
+    def shape(self):
+        # Used for collisions, so the eraser only hits the ink and not the bounding box
+        if self.outline is None:
+            path = QPainterPath()
+            path.addPolygon(self.polygon())
+            stroker = QPainterPathStroker()
+            stroker.setWidth(max(self.ink.widthF(), 1))
+            stroker.setCapStyle(Qt.RoundCap)
+            stroker.setJoinStyle(Qt.RoundJoin)
+            self.outline = stroker.createStroke(path)
+        return self.outline
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(self.ink)
+        painter.drawPolyline(self.polygon())
+
+
+class MovableShape:
+    """Rectangles and ellipses can be dragged around, the scene is told so it can reindex them."""
+
+    def setup(self, pen):
+        self.setPen(pen)
+        self.setFlag(QGraphicsItem.ItemIsMovable)
+        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges)
+
+    def itemChange(self, change, value):
+        if change == QGraphicsItem.ItemPositionHasChanged and self.scene() is not None:
+            self.scene().drawing_moved(self)
+        return super().itemChange(change, value)
+
+
+class Rectangle(MovableShape, QGraphicsRectItem):
+    def __init__(self, rect, pen):
+        super().__init__(rect)
+        self.setup(pen)
+
+
+class Ellipse(MovableShape, QGraphicsEllipseItem):
+    def __init__(self, rect, pen):
+        super().__init__(rect)
+        self.setup(pen)
+
+
+class PageDrawings:
+    """The drawings of a page.
+
+    Items are kept in insertion order with O(1) membership and removal, and a
+    uniform grid over their bounding boxes answers which items may touch a
+    given rectangle without testing all of them.
+    """
+
+    CELL_SIZE = 128
+
+    def __init__(self):
+        self.items = {}
+        self.grid = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(list(self.items))
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def cells(self, rect):
+        rect = rect.normalized()
+        x0 = math.floor(rect.left() / self.CELL_SIZE)
+        x1 = math.floor(rect.right() / self.CELL_SIZE)
+        y0 = math.floor(rect.top() / self.CELL_SIZE)
+        y1 = math.floor(rect.bottom() / self.CELL_SIZE)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def add(self, item):
+        cells = self.cells(item.sceneBoundingRect())
+        self.items[item] = cells
+        for cell in cells:
+            self.grid.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        for cell in self.items.pop(item):
+            bucket = self.grid[cell]
+            bucket.discard(item)
+            if not bucket:
+                del self.grid[cell]
+
+    def update(self, item):
+        if item in self.items:
+            self.remove(item)
+            self.add(item)
+
+    def query(self, rect):
+        found = set()
+        for cell in self.cells(rect):
+            found.update(self.grid.get(cell, ()))
+        return found
+
+    def clear(self):
+        self.items.clear()
+        self.grid.clear()
+
+
+def item_to_dict(item):
+    pen = item.pen()
+    data = {"color": pen.color().name(QColor.HexArgb), "width": pen.widthF()}
+    if isinstance(item, Stroke):
+        # float32 is plenty for scene coordinates and halves the size
+        data["type"] = "stroke"
+        data["points"] = base64.b64encode(item.points.astype(np.float32).tobytes()).decode("ascii")
+    else:
+        rect = item.rect()
+        data["type"] = "ellipse" if isinstance(item, Ellipse) else "rect"
+        data["rect"] = [rect.x(), rect.y(), rect.width(), rect.height()]
+        data["pos"] = [item.pos().x(), item.pos().y()]
+    return data
+
+
+def item_from_dict(data):
+    pen = QPen(QColor(data["color"]), data["width"])
+    if data["type"] == "stroke":
+        points = np.frombuffer(base64.b64decode(data["points"]), dtype=np.float32).reshape(-1, 2)
+        item = Stroke(pen, QPointF(*points[0]))
+        item.set_points(points)
+    else:
+        shape = Ellipse if data["type"] == "ellipse" else Rectangle
+        item = shape(QRectF(*data["rect"]), pen)
+        item.setPos(*data["pos"])
+    return item
+
+
+def burn_in(page, items, zoom):
+    """Draws the items on the PDF page as vector graphics, zoom being the scene units per point."""
+    shape = page.new_shape()
+    matrix = fitz.Matrix(1 / zoom, 1 / zoom) * page.derotation_matrix
+    for item in items:
+        pen = item.pen()
+        color = pen.color()
+        rgb = (color.redF(), color.greenF(), color.blueF())
+        width = pen.widthF() / zoom
+        if isinstance(item, Stroke):
+            if len(item) < 2:
+                continue
+            shape.draw_polyline([fitz.Point(x, y) * matrix for x, y in item.points])
+            shape.finish(color=rgb, width=width, closePath=False, lineCap=1, lineJoin=1,
+                         stroke_opacity=color.alphaF())
+        else:
+            # Rectangles dragged up or left have a negative size
+            rect = item.mapRectToScene(item.rect().normalized())
+            rect = fitz.Rect(rect.left(), rect.top(), rect.right(), rect.bottom()) * matrix
+            if isinstance(item, Ellipse):
+                shape.draw_oval(rect)
+            else:
+                shape.draw_rect(rect)
+            shape.finish(color=rgb, width=width, stroke_opacity=color.alphaF())
+    shape.commit()
+
+
+class AnnotationStore(QueueWorker):
+    """Drawings of a deck on disk, one JSON lines file per PDF page.
+
+    Pages are read on demand and written by this thread, so that saving
+    never blocks drawing. Only the latest version of a page is kept pending.
+    """
+
+    # Pending pages are still written before the thread ends
+    DRAIN_ON_STOP = True
+
+    def __init__(self, pdf_path, root=ANNOTATIONS_DIR):
+        super().__init__()
+        self.path = os.path.join(root, hashlib.sha1(os.path.abspath(pdf_path).encode("utf-8")).hexdigest())
+
+    def page_path(self, pdf_page):
+        return os.path.join(self.path, "{:05d}.jsonl".format(pdf_page))
+
+    def load(self, pdf_page):
+        items = []
+        try:
+            with open(self.page_path(pdf_page), encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        items.append(item_from_dict(json.loads(line)))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"An error occurred: {e}")
+        return items
+
+    def save(self, pdf_page, items):
+        self.put(pdf_page, [json.dumps(item_to_dict(item)) + "\n" for item in items])
+
+    def write(self, pdf_page, lines):
+        path = self.page_path(pdf_page)
+        if not lines:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(path + ".tmp", path)
+
+    def process(self, pdf_page, lines):
+        try:
+            self.write(pdf_page, lines)
+        except OSError as e:
+            print(f"An error occurred: {e}")
@@ -0,0 +1,136 @@
+import bisect
+import math
+import re
+
+
+class WordIndex:
+    """Words of a document plus some fixed ones, sorted for prefix lookups.
+
+    The words of every block are remembered, so a change of the document only
+    updates the counts of the blocks it touched. A word stays in the sorted
+    list while its count is above zero.
+
+    The words of the lines being edited and the accepted completions are
+    remembered with a tick, to rank the recent ones first.
+    """
+
+    WORD = re.compile(r"\w+")
+
+    # Weights of the ranking, on top of the logarithm of the count
+    RECENT = 3.0
+    DECAY = 0.9
+    NEAR = 2.0
+    SCOPE = 15
+
+    def __init__(self):
+        self.counts = {}
+        self.words = []
+        self.blocks = []
+        self.static = []
+        self.used = {}
+        self.tick = 0
+        self.document = None
+
+    def __contains__(self, word):
+        return word in self.counts
+
+    def __len__(self):
+        return len(self.words)
+
+    def attach(self, document):
+        self.document = document
+        self.blocks = [[] for _ in range(document.blockCount())]
+        self.contents_changed(0, 0, document.characterCount())
+        document.contentsChange.connect(self.contents_changed)
+
+    def set_static(self, words):
+        for word in self.static:
+            self.remove(word)
+        self.static = list(words)
+        for word in self.static:
+            self.add(word)
+
+    def add(self, word):
+        count = self.counts.get(word, 0)
+        if count == 0:
+            bisect.insort(self.words, word)
+        self.counts[word] = count + 1
+
+    def remove(self, word):
+        count = self.counts[word] - 1
+        if count == 0:
+            del self.counts[word]
+            del self.words[bisect.bisect_left(self.words, word)]
+            self.used.pop(word, None)
+        else:
+            self.counts[word] = count
+
+    def contents_changed(self, position, removed, added):
+        # The blocks from the one holding position to the one holding the end of the
+        # insertion replace as many old blocks, minus the ones the change created
+        first = self.document.findBlock(position)
+        last = self.document.findBlock(position + added)
+        if not last.isValid():
+            last = self.document.lastBlock()
+        delta = self.document.blockCount() - len(self.blocks)
+
+        words = []
+        block = first
+        while block.isValid() and block.blockNumber() <= last.blockNumber():
+            words.append(self.WORD.findall(block.text()))
+            block = block.next()
+
+        start, end = first.blockNumber(), last.blockNumber() + 1 - delta
+        for old in self.blocks[start:end]:
+            for word in old:
+                self.remove(word)
+        for new in words:
+            for word in new:
+                self.add(word)
+        self.blocks[start:end] = words
+
+        # Typing touches a block or two, loading a file is not a use of its words
+        if len(words) <= 2:
+            self.tick += 1
+            for new in words:
+                for word in new:
+                    self.used[word] = self.tick
+
+    def touch(self, word):
+        self.tick += 1
+        self.used[word] = self.tick
+
+    def complete(self, prefix):
+        """Words starting with the prefix, in alphabetical order."""
+        candidates = []
+        i = bisect.bisect_left(self.words, prefix)
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            candidates.append(self.words[i])
+            i += 1
+        return candidates
+
+    def rank(self, prefix, block_number=None, extra=(), local=True):
+        """Completions of the prefix, the most likely first.
+
+        The extra words, the names known by the kernel, go before the words of
+        the index, which are left out if local is False. Within each group
+        frequent words, recently used words and words of the lines around
+        block_number go first.
+        """
+        near = set()
+        if block_number is not None:
+            for words in self.blocks[max(0, block_number - self.SCOPE):block_number + self.SCOPE + 1]:
+                near.update(words)
+        extra = {word for word in extra if word.startswith(prefix)}
+        candidates = (set(self.complete(prefix)) if local else set()) | extra
+        candidates.discard(prefix)
+
+        def score(word):
+            value = math.log1p(self.counts.get(word, 0))
+            if word in self.used:
+                value += self.RECENT * self.DECAY ** (self.tick - self.used[word])
+            if word in near:
+                value += self.NEAR
+            return value
+
+        return sorted(candidates, key=lambda word: (word not in extra, -score(word), len(word), word))
@@ -43,6 +43,7 @@ class EditorWidget(QWidget):
         self.language_editor.ctrl_enter.connect(self.execute_code)
         self.language_editor.ctrl_shift_enter.connect(self.execute_single_line)
         self.language_editor.info.connect(self.update_status_bar)
+        self.language_editor.set_completion_provider(self.console)
 
         bar = QToolBar()
 
@@ -1,4 +1,7 @@
-from PyQt5.QtCore import Qt, QRegExp
+import re
+import time
+
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont
 
 
@@ -9,56 +12,190 @@ class Scheme:
         self.color_dark = color2
 
 class SyntaxHighlighter(QSyntaxHighlighter):
-
-
+    # Block states, a block ending inside a triple quoted string tells which one
+    NORMAL = 0
+    IN_SINGLE_TRIPLE = 1
+    IN_DOUBLE_TRIPLE = 2
+    DELIMITERS = {IN_SINGLE_TRIPLE: "'''", IN_DOUBLE_TRIPLE: '"""'}
+    # Only languages with triple quoted strings, in Pascal '' is an escaped quote
+    TRIPLE_QUOTES = False
+
+    # Texts with more lines are colored in the background, SLICE seconds at a time
+    DEFER_LINES = 2000
+    SLICE = 0.01
 
     def __init__(self, *schemes):
         super().__init__(None)
-        self.highlighting_rules = []
         self.schemes = schemes
         self.dark = False
         self.keywords = []
+        self.formats = {}
+        self.pattern = None
+        self.deferring = False
+        self.down = 0
+        self.up = -1
+        self.block_count = 0
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.process_pending)
         self.apply_schemes()
 
     def set_dark_mode(self, dark):
         self.dark = dark
-        self.highlighting_rules.clear()
         self.apply_schemes()
 
     def apply_schemes(self):
-        for scheme in self.schemes: # Scheme
+        # All the rules are compiled into a single alternation, one named group
+        # per rule, so every line is tokenized in one pass whatever the number of keywords
+        self.formats = {}
+        self.keywords = []
+        rules = []
+        for i, scheme in enumerate(self.schemes): # Scheme
             keyword_format = QTextCharFormat()
             keyword_format.setForeground(scheme.color_light if not self.dark else scheme.color_dark)
             keyword_format.setFontWeight(QFont.Bold)
 
-            self.highlighting_rules += [(f"\\b{k}\\b", keyword_format) for k in scheme.keywords]
+            words = sorted(set(scheme.keywords), key=len, reverse=True)
+            rules.append(("scheme{}".format(i), r"\b(?:{})\b".format("|".join(map(re.escape, words))), keyword_format))
             self.keywords += scheme.keywords
 
         string_format = QTextCharFormat()
         string_format.setForeground(Qt.magenta)
-        self.highlighting_rules.append((r'".*"', string_format))
-        self.highlighting_rules.append((r"'.*'", string_format))
+        # Triple quotes go first, their end is looked for by hand as it can be in another block
+        if self.TRIPLE_QUOTES:
+            rules.append(("triple", r'"""|\'\'\'', string_format))
+        # Strings stop at the first unescaped quote, or at the end of the line if unterminated
+        rules.append(("string", r'"(?:[^"\\]|\\.)*"?|\'(?:[^\'\\]|\\.)*\'?', string_format))
 
         comment_format = QTextCharFormat()
         comment_format.setForeground(QColor("green"))
         comment_format.setFontItalic(True)
-        self.highlighting_rules.append((r"#.*", comment_format))
-
+        rules.append(("comment", r"#.*", comment_format))
+
+        self.formats = {name: fmt for name, _, fmt in rules}
+        self.pattern = re.compile("|".join("(?P<{}>{})".format(name, regex) for name, regex, _ in rules))
+
+    @staticmethod
+    def utf16_offsets(text):
+        # Qt counts positions in UTF-16 code units, characters out of the BMP take two
+        offsets = [0]
+        for c in text:
+            offsets.append(offsets[-1] + (2 if ord(c) > 0xFFFF else 1))
+        return offsets
+
+    @staticmethod
+    def close_string(text, pos, delimiter):
+        # Position right after the closing delimiter, -1 if the string goes on in the next block
+        i = pos
+        while True:
+            i = text.find(delimiter, i)
+            if i < 0:
+                return -1
+            j = i
+            while j > pos and text[j - 1] == "\\":
+                j -= 1
+            if (i - j) % 2 == 0:
+                return i + len(delimiter)
+            i += 1
+
+    def defer(self):
+        """Until resume() blocks only get their state, the formats are applied later."""
+        self.timer.stop()
+        self.deferring = True
+
+    def resume(self, block):
+        # Colors spread from the given block, usually the first visible one, in both
+        # directions. Block numbers are kept, as edits can delete the blocks themselves
+        self.deferring = False
+        self.down = block.blockNumber()
+        self.up = self.down - 1
+        self.block_count = self.document().blockCount()
+        self.process_pending()
+        self.timer.start(0)
+
+    def center_on(self, block):
+        # Scrolled outside the colored region, move there. Blocks may be colored twice but none is skipped
+        if self.timer.isActive() and not self.up < block.blockNumber() < self.down:
+            self.down = block.blockNumber()
+            self.up = self.down - 1
+
+    def contents_changed(self, position, removed, added):
+        # Lines added or removed before the frontiers move them
+        if not self.timer.isActive():
+            return
+        delta = self.document().blockCount() - self.block_count
+        self.block_count += delta
+        changed = self.document().findBlock(position).blockNumber()
+        if changed < self.down:
+            self.down = max(changed, self.down + delta)
+        if changed < self.up:
+            self.up = max(changed, self.up + delta)
+
+    def process_pending(self):
+        document = self.document()
+        deadline = time.perf_counter() + self.SLICE
+        while time.perf_counter() < deadline:
+            down = document.findBlockByNumber(self.down)
+            up = document.findBlockByNumber(self.up)
+            if not down.isValid() and not up.isValid():
+                self.timer.stop()
+                return
+            # A state that does not change stops Qt from going on with the next block
+            if down.isValid():
+                self.rehighlightBlock(down)
+                self.down += 1
+            if up.isValid():
+                self.rehighlightBlock(up)
+                self.up -= 1
 
     def highlightBlock(self, text):
-        for pattern, fmt in self.highlighting_rules:
-            expression = QRegExp(pattern)
-            index = expression.indexIn(text)
-            while index >= 0:
-                length = expression.matchedLength()
-                self.setFormat(index, length, fmt)
-                index = expression.indexIn(text, index + length)
+        state = self.previousBlockState()
+        if self.deferring and state not in self.DELIMITERS and (
+                not self.TRIPLE_QUOTES or "'''" not in text and '"""' not in text):
+            # Nothing can change the state of the next block
+            self.setCurrentBlockState(self.NORMAL)
+            return
+
+        offsets = None if text.isascii() or max(text) <= "\uffff" else self.utf16_offsets(text)
+
+        def set_format(start, end, name):
+            if self.deferring:
+                return
+            if offsets is not None:
+                start, end = offsets[start], offsets[end]
+            self.setFormat(start, end - start, self.formats[name])
+
+        # Qt highlights the next block again only if the state of this one changes,
+        # so an edit costs one block unless it opens or closes a triple quoted string
+        pos = 0
+        if state in self.DELIMITERS:
+            pos = self.close_string(text, 0, self.DELIMITERS[state])
+            if pos < 0:
+                set_format(0, len(text), "triple")
+                self.setCurrentBlockState(state)
+                return
+            set_format(0, pos, "triple")
+
+        while True:
+            m = self.pattern.search(text, pos)
+            if m is None:
+                break
+            pos = m.end()
+            if m.lastgroup == "triple":
+                pos = self.close_string(text, pos, m.group())
+                if pos < 0:
+                    set_format(m.start(), len(text), "triple")
+                    self.setCurrentBlockState(self.IN_SINGLE_TRIPLE if m.group() == "'''" else self.IN_DOUBLE_TRIPLE)
+                    return
+            set_format(m.start(), pos, m.lastgroup)
+        self.setCurrentBlockState(self.NORMAL)
 
     def get_keywords(self):
         return self.keywords
 
 
 class PythonHighlighter(SyntaxHighlighter):
+    TRIPLE_QUOTES = True
+
     def __init__(self, dark=False):
         super().__init__(
             Scheme(['return', 'nonlocal', 'elif', 'assert', 'or', 'yield', 'finally',
@@ -72,7 +209,7 @@ class PythonHighlighter(SyntaxHighlighter):
 
 class PascalHighlighter(SyntaxHighlighter):
     def __init__(self, dark=False):
-        super().__init__([([
+        super().__init__(Scheme([
                                "and", "array", "asm", "begin", "case", "const", "constructor", "destructor",
                                "div", "do", "downto", "else", "end", "file", "for", "function", "goto", "if",
                                "implementation", "in", "inherited", "inline", "interface", "label", "mod", "nil",
@@ -84,4 +221,4 @@ class PascalHighlighter(SyntaxHighlighter):
                                "NOT", "OBJECT", "OF", "OR", "PACKED", "PROCEDURE", "PROGRAM", "RECORD", "REPEAT",
                                "SET", "SHL", "SHR", "STRING", "THEN", "TO", "TYPE", "UNIT", "UNTIL", "USES",
                                "VAR", "WHILE", "WITH", "XOR"
-                           ], Qt.blue, Qt.blue)])
+                           ], Qt.blue, Qt.blue))
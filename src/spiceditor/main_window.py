@@ -14,6 +14,7 @@ from spiceditor.dialogs import Author
 from spiceditor.editor_widget import EditorWidget
 from spiceditor.file_browser import FileBrowser
 from spiceditor.highlighter import PythonHighlighter, PascalHighlighter
+from spiceditor.slide_search import SearchDialog
 from spiceditor.spice_magic_editor import PythonEditor, PascalEditor
 from spiceditor.spice_console import JupyterConsole, TermQtConsole
 from spiceditor.textract import Slides
@@ -27,6 +28,15 @@ class CustomTabBar(QTabBar):
         self.a = QPushButton(self)
 
 
+class SlidesPlaceholder(QWidget):
+    """Stands for a deck restored from the last session until its tab is activated."""
+
+    def __init__(self, filename, page):
+        super().__init__()
+        self.filename = filename
+        self.page = page
+
+
 class MainWindow(QMainWindow):
 
     def __init__(self, console):
@@ -175,8 +185,17 @@ class MainWindow(QMainWindow):
         q = QShortcut("Ctrl+K", self)
         q.activated.connect(self.show_only)
 
+        self.search_dialog = SearchDialog(self)
+        self.search_dialog.result_selected.connect(self.show_search_result)
+
+        q = QShortcut("Ctrl+F", self)
+        q.activated.connect(self.search_slides)
+
+        # Restored decks are only opened when their tab is first shown
         for elem in self.cfg_last.get_value():
-            self.open_slides(elem.get("filename"), elem.get("page", 0))
+            self.open_slides(elem.get("filename"), elem.get("page", 0), lazy=True)
+        if self.slides_tabs.count() > 1:
+            self.slides_tabs.setCurrentIndex(self.slides_tabs.count() - 1)
 
         if self.cfg_open_fullscreen.get_value():
             self.toggle_fullscreen()
@@ -354,6 +373,8 @@ class MainWindow(QMainWindow):
         if index == 0:
             self.apply_color_scheme(self.cfg_dark.get_value() == 1)
         else:
+            if isinstance(self.slides_tabs.widget(index), SlidesPlaceholder):
+                self.load_placeholder(index)
             # self.update_toolbar_position()
             self.setStyleSheet("")
 
@@ -362,9 +383,22 @@ class MainWindow(QMainWindow):
 
     def close_tab_requested(self, index):
         if index > 0:
+            widget = self.slides_tabs.widget(index)
             self.slides_tabs.removeTab(index)
+            if isinstance(widget, Slides):
+                widget.close_document()
+
+    @staticmethod
+    def slides_name(filename):
+        name = filename.split(os.sep)[-1].replace(".pdf", "")
+        return name[0:12] + "..." + name[-12:] if len(name) > 27 else name
 
-    def open_slides(self, filename=None, page=0):
+    def create_slides(self, filename, page):
+        slides = Slides(self.config, filename, page)
+        slides.play_code.connect(self.code_from_slide)
+        return slides
+
+    def open_slides(self, filename=None, page=0, lazy=False):
         # open pdf file
         path = self.cfg_slides_path.get_value() + os.sep
         if filename is None:
@@ -372,23 +406,68 @@ class MainWindow(QMainWindow):
                                                        directory=path, options=QFileDialog.Options())
 
         if filename:
-            name = filename.split(os.sep)[-1].replace(".pdf", "")
-
-            name = name[0:12] + "..." + name[-12:] if len(name) > 27 else name
+            name = self.slides_name(filename)
 
             if os.path.exists(filename):
-                slides = Slides(self.config, filename, page)
-                slides.play_code.connect(self.code_from_slide)
+                if lazy:
+                    self.slides_tabs.addTab(SlidesPlaceholder(filename, page), name)
+                    return
+
+                slides = self.create_slides(filename, page)
                 self.slides_tabs.addTab(slides, name)
                 self.slides_tabs.setCurrentWidget(slides)
                 slides.view.setFocus()
 
+    def load_placeholder(self, index):
+        placeholder = self.slides_tabs.widget(index)
+        slides = self.create_slides(placeholder.filename, placeholder.page)
+
+        # Swap the tabs silently, the current index does not really change
+        self.slides_tabs.blockSignals(True)
+        self.slides_tabs.removeTab(index)
+        self.slides_tabs.insertTab(index, slides, self.slides_name(placeholder.filename))
+        self.slides_tabs.setCurrentIndex(index)
+        self.slides_tabs.blockSignals(False)
+        placeholder.deleteLater()
+        slides.view.setFocus()
+
+    def search_slides(self):
+        decks = []
+        for i in range(1, self.slides_tabs.count()):
+            widget = self.slides_tabs.widget(i)
+            if isinstance(widget, (Slides, SlidesPlaceholder)):
+                decks.append(widget.filename)
+        self.search_dialog.set_decks(decks, self.cfg_slides_path.get_value())
+        self.search_dialog.show()
+        self.search_dialog.raise_()
+        self.search_dialog.activateWindow()
+        self.search_dialog.edit.setFocus()
+        self.search_dialog.edit.selectAll()
+
+    def show_search_result(self, filename, pdf_page, rects):
+        for i in range(1, self.slides_tabs.count()):
+            widget = self.slides_tabs.widget(i)
+            if isinstance(widget, (Slides, SlidesPlaceholder)) and widget.filename == filename:
+                # Placeholders are loaded by the tab change
+                self.slides_tabs.setCurrentIndex(i)
+                break
+        else:
+            self.open_slides(filename)
+
+        slides = self.slides_tabs.currentWidget()
+        if isinstance(slides, Slides) and slides.filename == filename:
+            slides.go_to(slides.page_map.index_of(pdf_page))
+            slides.highlight(rects)
+
     def closeEvent(self, a0):
+        self.search_dialog.stop()
         last = []
         for i in range(1, self.slides_tabs.count()):
             widget = self.slides_tabs.widget(i)
-            if isinstance(widget, Slides):
+            if isinstance(widget, (Slides, SlidesPlaceholder)):
                 last.append({"filename": widget.filename, "page": widget.page})
+            if isinstance(widget, Slides):
+                widget.close_document()
         self.cfg_last.set_value(last)
         self.config.save("spiceditor.yaml")
 
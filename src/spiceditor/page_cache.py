@@ -0,0 +1,91 @@
+from collections import OrderedDict
+
+import fitz  # PyMuPDF
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtGui import QImage
+
+from spiceditor.worker import QueueWorker
+
+
+def render_page(page, zoom, annots=True):
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False, annots=annots)
+    # copy() detaches the image from the pixmap samples buffer
+    return QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888).copy()
+
+
+class RenderCache:
+    """LRU cache of rendered pages keyed by (pdf page, zoom, annots)."""
+
+    def __init__(self, budget=256 * 1024 * 1024):
+        self.budget = budget
+        self.used = 0
+        self.pixmaps = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.pixmaps
+
+    def __len__(self):
+        return len(self.pixmaps)
+
+    @staticmethod
+    def cost(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def get(self, key):
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        if key in self.pixmaps:
+            self.used -= self.cost(self.pixmaps.pop(key))
+        self.pixmaps[key] = pixmap
+        self.used += self.cost(pixmap)
+
+        # Always keep the most recent entry, even if it is over budget
+        while self.used > self.budget and len(self.pixmaps) > 1:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.used -= self.cost(evicted)
+
+    def find(self, pdf_page):
+        # Any render of the page, whatever its zoom
+        for key, pixmap in self.pixmaps.items():
+            if key[0] == pdf_page:
+                return pixmap
+        return None
+
+    def clear(self):
+        self.pixmaps.clear()
+        self.used = 0
+
+
+class PageRenderer(QueueWorker):
+    """Renders pages in the background using its own handle on the document."""
+
+    rendered = pyqtSignal(object, QImage)
+
+    def __init__(self, pdf_path):
+        super().__init__()
+        self.pdf_path = pdf_path
+        self.doc = None
+
+    def request(self, keys):
+        # New requests replace the old ones: pages we moved away from are stale
+        self.replace((key, None) for key in keys)
+
+    def process(self, key, job):
+        pdf_page, zoom, annots = key
+        try:
+            image = render_page(self.doc[pdf_page], zoom, annots)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return
+        self.rendered.emit(key, image)
+
+    def run(self):
+        self.doc = fitz.open(self.pdf_path)
+        try:
+            super().run()
+        finally:
+            self.doc.close()
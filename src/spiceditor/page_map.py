@@ -0,0 +1,72 @@
+class PageMap:
+    """Maps the slides being shown (PDF pages plus inserted blank pages) to PDF pages.
+
+    Blank pages are kept in groups, group g holding the blanks right before PDF
+    page g and the last group the ones after the last page. A Fenwick tree over
+    the size of the groups gives O(log n) lookups and insertions.
+    """
+
+    def __init__(self, pdf_pages):
+        self.pdf_pages = pdf_pages
+        self.blanks = [[] for _ in range(pdf_pages + 1)]
+        self.next_blank = 0
+
+        # Every group weighs its blanks plus its PDF page, the last group's page
+        # is a sentinel that is never shown. All weights start at 1.
+        self.size = pdf_pages + 1
+        self.tree = [i & -i for i in range(self.size + 1)]
+        self.step = 1 << (self.size.bit_length() - 1)
+
+    def __len__(self):
+        return self.prefix(self.size) - 1
+
+    def add(self, group, delta):
+        i = group + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, groups):
+        # Number of slides in the first groups
+        total = 0
+        while groups > 0:
+            total += self.tree[groups]
+            groups -= groups & -groups
+        return total
+
+    def locate(self, index):
+        # Returns the group containing the slide and its offset in the group
+        group, step = 0, self.step
+        while step:
+            if group + step <= self.size and self.tree[group + step] <= index:
+                group += step
+                index -= self.tree[group]
+            step >>= 1
+        return group, index
+
+    def pdf_page(self, index):
+        """PDF page shown at the index, None for a blank page."""
+        group, offset = self.locate(index)
+        return None if offset < len(self.blanks[group]) else group
+
+    def key(self, index):
+        """Identifier of the page that does not change when blank pages are inserted."""
+        group, offset = self.locate(index)
+        if offset < len(self.blanks[group]):
+            return "blank", self.blanks[group][offset]
+        return group
+
+    def index_of(self, pdf_page):
+        return self.prefix(pdf_page + 1) - 1
+
+    def insert_blank(self, index):
+        """Inserts a blank page after the index and returns the index of the new page."""
+        group, offset = self.locate(index)
+        if offset < len(self.blanks[group]):
+            self.blanks[group].insert(offset + 1, self.next_blank)
+        else:
+            group += 1
+            self.blanks[group].insert(0, self.next_blank)
+        self.next_blank += 1
+        self.add(group, 1)
+        return index + 1
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import fitz  # PyMuPDF
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from spiceditor.page_cache import render_page
+
+# Code regions are framed in magenta in the slides
+CODE_COLOR = (1.0, 0, 1.0)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".spiceditor", "cache")
+INDEX_VERSION = 1
+THUMBNAIL_WIDTH = 160
+
+
+def find_code_rects(page):
+    rects = []
+    for d in page.get_drawings():
+        if d.get("type") != 'f' and d.get("color") == CODE_COLOR:
+            rects.append(d.get("rect"))
+    return rects
+
+
+def extract_program(page, rect):
+    lines = []
+    try:
+        # Extract blocks of text
+        blocks = page.get_text("dict", clip=rect)['blocks']
+        for block in blocks:
+            if 'lines' in block:  # Ensure the block contains text
+                for line in block['lines']:
+                    line_text = ""
+                    for span in line['spans']:
+                        line_text += span['text']
+                    lines.append((line_text, line["bbox"]))
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+    if len(lines) == 0:
+        return None
+
+    # Indentation levels are rebuilt from the distinct x positions of the lines
+    xs = sorted({int(pos[0]) for _, pos in lines})
+    levels = {x: i for i, x in enumerate(xs)}
+
+    program = str()
+    for text, pos in lines:
+        program += " " * levels[int(pos[0])] * 4 + text + "\n"
+    return program
+
+
+def extract_code_blocks(page):
+    """Returns the (x, y, w, h) rectangle and program of each code region of the page."""
+    blocks = []
+    for rect in find_code_rects(page):
+        program = extract_program(page, rect)
+        if program is not None:
+            blocks.append(((rect.x0, rect.y0, rect.x1 - rect.x0, rect.y1 - rect.y0), program))
+    return blocks
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class IndexStore:
+    """Sidecar cache of slide indexes, one folder per PDF content hash.
+
+    A stamp file remembers the size, mtime and hash of every deck seen so far,
+    so the PDF only has to be hashed again when it changes on disk.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.stamps_path = os.path.join(root, "stamps.json")
+
+    @staticmethod
+    def read_json(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def write_json(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def stamp(pdf_path):
+        stat = os.stat(pdf_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def cached_key(self, pdf_path):
+        # Cheap lookup that does not read the PDF, None if it changed since last time
+        stamps = self.read_json(self.stamps_path) or {}
+        entry = stamps.get(os.path.abspath(pdf_path))
+        if entry is not None and entry[:2] == self.stamp(pdf_path):
+            return entry[2]
+        return None
+
+    def key(self, pdf_path):
+        key = self.cached_key(pdf_path)
+        if key is not None:
+            return key
+
+        key = file_hash(pdf_path)
+        with self.lock:
+            stamps = self.read_json(self.stamps_path) or {}
+            old = stamps.get(os.path.abspath(pdf_path))
+            stamps[os.path.abspath(pdf_path)] = self.stamp(pdf_path) + [key]
+            self.write_json(self.stamps_path, stamps)
+
+            # Drop the index of the previous version of the deck if nobody else uses it
+            if old is not None and old[2] != key and all(e[2] != old[2] for e in stamps.values()):
+                shutil.rmtree(self.path(old[2]), ignore_errors=True)
+        return key
+
+    def path(self, key, *parts):
+        return os.path.join(self.root, key, *parts)
+
+    def load(self, key, name="index"):
+        data = self.read_json(self.path(key, name + ".json"))
+        if data is None or data.get("version") != INDEX_VERSION:
+            return None
+        return data
+
+    def save(self, key, data, name="index"):
+        data["version"] = INDEX_VERSION
+        self.write_json(self.path(key, name + ".json"), data)
+
+    def thumbnail_path(self, key, pdf_page):
+        return self.path(key, "thumbnails", "{:05d}.png".format(pdf_page))
+
+
+def load_code_index(data):
+    return {pdf_page: [(tuple(rect), program) for rect, program in blocks]
+            for pdf_page, blocks in enumerate(data["code"])}
+
+
+class SlideIndexer(QThread):
+    """Walks the whole document once in the background, building the code index.
+
+    The index and low resolution thumbnails of every page are stored in the
+    IndexStore, so the next time the same PDF is opened the pass is skipped.
+    """
+
+    indexed = pyqtSignal(int, list)
+    done = pyqtSignal(str)
+
+    def __init__(self, pdf_path, store):
+        super().__init__()
+        self.pdf_path = pdf_path
+        self.store = store
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+    def run(self):
+        try:
+            key = self.store.key(self.pdf_path)
+        except OSError as e:
+            print(f"An error occurred: {e}")
+            return
+
+        data = self.store.load(key)
+        if data is not None:
+            for pdf_page, blocks in load_code_index(data).items():
+                self.indexed.emit(pdf_page, blocks)
+            self.done.emit(key)
+            return
+
+        code = []
+        doc = fitz.open(self.pdf_path)
+        try:
+            os.makedirs(self.store.path(key, "thumbnails"), exist_ok=True)
+            for pdf_page in range(len(doc)):
+                if not self.running:
+                    return
+                page = doc[pdf_page]
+                blocks = extract_code_blocks(page)
+                code.append(blocks)
+                self.indexed.emit(pdf_page, blocks)
+
+                thumbnail = render_page(page, THUMBNAIL_WIDTH / page.rect.width, False)
+                thumbnail.save(self.store.thumbnail_path(key, pdf_page))
+        finally:
+            doc.close()
+
+        self.store.save(key, {"pages": len(code), "code": code})
+        self.done.emit(key)
@@ -0,0 +1,217 @@
+import bisect
+import os
+import re
+
+import fitz  # PyMuPDF
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QListWidget, QListWidgetItem, QCheckBox, QLabel
+
+from spiceditor.slide_index import IndexStore
+from spiceditor.worker import QueueWorker
+
+
+def tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class SearchResult:
+    def __init__(self, filename, pdf_page, rects, snippet):
+        self.filename = filename
+        self.pdf_page = pdf_page
+        self.rects = rects
+        self.snippet = snippet
+
+
+class TextIndex:
+    """Inverted index of the words of a deck.
+
+    Pages are lists of [x0, y0, x1, y1, word] as given by PyMuPDF, the index
+    maps every token to the (page, word) pairs where it appears. Tokens are
+    kept sorted so the last word of a query can be matched as a prefix.
+    """
+
+    SNIPPET = 6
+
+    def __init__(self, filename, pages):
+        self.filename = filename
+        self.pages = pages
+        self.postings = {}
+        for pdf_page, words in enumerate(pages):
+            for i, word in enumerate(words):
+                for token in tokens(word[4]):
+                    self.postings.setdefault(token, []).append((pdf_page, i))
+        self.sorted_tokens = sorted(self.postings)
+
+    def lookup(self, term, prefix):
+        if not prefix:
+            return [term] if term in self.postings else []
+        start = bisect.bisect_left(self.sorted_tokens, term)
+        end = bisect.bisect_left(self.sorted_tokens, term + "\uffff")
+        return self.sorted_tokens[start:end]
+
+    def search(self, query):
+        terms = tokens(query)
+        if not terms:
+            return []
+
+        # Pages must contain every term, the last one may still be being typed
+        pages = None
+        hits = {}
+        for n, term in enumerate(terms):
+            found = {}
+            for token in self.lookup(term, n == len(terms) - 1):
+                for pdf_page, i in self.postings[token]:
+                    found.setdefault(pdf_page, set()).add(i)
+            pages = set(found) if pages is None else pages & set(found)
+            for pdf_page, words in found.items():
+                hits.setdefault(pdf_page, set()).update(words)
+
+        results = []
+        for pdf_page in sorted(pages):
+            words = self.pages[pdf_page]
+            matched = sorted(hits[pdf_page])
+            first = max(0, matched[0] - self.SNIPPET // 2)
+            snippet = " ".join(w[4] for w in words[first:first + self.SNIPPET * 2])
+            results.append(SearchResult(self.filename, pdf_page, [words[i][:4] for i in matched], snippet))
+        return results
+
+
+def extract_words(pdf_path):
+    # One page at a time, so that the caller can stop in between
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield [list(w[:5]) for w in page.get_text("words")]
+
+
+class TextIndexer(QueueWorker):
+    """Builds the text indexes of the queued decks in the background, cached in the IndexStore.
+
+    Decks are indexed one at a time, a whole folder can be queued without
+    starting a thread per deck. On stop() the one being indexed is left at
+    the current page.
+    """
+
+    ready = pyqtSignal(str, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def add(self, pdf_path):
+        self.put(pdf_path)
+
+    def process(self, pdf_path, job):
+        try:
+            self.index(pdf_path)
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"An error occurred: {e}")
+            self.failed.emit(pdf_path)
+
+    def index(self, pdf_path):
+        key = self.store.key(pdf_path)
+        data = self.store.load(key, "text")
+        if data is None:
+            words = []
+            for page in extract_words(pdf_path):
+                if not self.running:
+                    return
+                words.append(page)
+            data = {"words": words}
+            self.store.save(key, data, "text")
+        self.ready.emit(pdf_path, TextIndex(pdf_path, data["words"]))
+
+
+class SearchDialog(QDialog):
+    result_selected = pyqtSignal(str, int, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Search slides")
+        self.setMinimumSize(500, 400)
+        self.store = IndexStore()
+        self.indexes = {}
+        self.queued = set()
+        self.indexer = TextIndexer(self.store)
+        self.indexer.ready.connect(self.index_ready)
+        self.indexer.failed.connect(self.index_failed)
+        self.indexer.start()
+        self.open_decks = []
+        self.decks = []
+        self.folder = None
+
+        self.edit = QLineEdit()
+        self.edit.setPlaceholderText("Search...")
+        self.edit.textChanged.connect(self.search)
+        self.include_folder = QCheckBox("Search the slides folder too")
+        self.include_folder.toggled.connect(self.update_decks)
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.activated)
+        self.results.itemClicked.connect(self.activated)
+        self.status = QLabel()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.edit)
+        layout.addWidget(self.include_folder)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+    def set_decks(self, decks, folder=None):
+        self.open_decks = list(decks)
+        self.folder = folder
+        self.update_decks()
+
+    def update_decks(self):
+        decks = list(self.open_decks)
+        if self.include_folder.isChecked() and self.folder and os.path.isdir(self.folder):
+            for filename in sorted(os.listdir(self.folder)):
+                if filename.lower().endswith(".pdf"):
+                    decks.append(os.path.join(self.folder, filename))
+
+        # A deck may be open in several tabs
+        self.decks = []
+        for filename in decks:
+            if os.path.abspath(filename) not in map(os.path.abspath, self.decks):
+                self.decks.append(filename)
+
+        for filename in self.decks:
+            if filename not in self.indexes and filename not in self.queued:
+                self.queued.add(filename)
+                self.indexer.add(filename)
+        self.search()
+
+    def index_ready(self, filename, index):
+        self.indexes[filename] = index
+        self.queued.discard(filename)
+        self.search()
+
+    def index_failed(self, filename):
+        # Not searched, it is queued again the next time the decks are updated
+        self.queued.discard(filename)
+        self.search()
+
+    def search(self):
+        self.results.clear()
+        query = self.edit.text()
+        count = 0
+        for filename in self.decks:
+            index = self.indexes.get(filename)
+            if index is None:
+                continue
+            for result in index.search(query):
+                item = QListWidgetItem("{} — {}: {}".format(os.path.basename(filename).replace(".pdf", ""),
+                                                            result.pdf_page + 1, result.snippet))
+                item.setData(Qt.UserRole, result)
+                self.results.addItem(item)
+                count += 1
+
+        pending = len([d for d in self.decks if d in self.queued])
+        self.status.setText("{} results".format(count) + (", indexing {} decks...".format(pending) if pending else ""))
+
+    def activated(self, item):
+        result = item.data(Qt.UserRole)
+        self.result_selected.emit(result.filename, result.pdf_page, result.rects)
+
+    def stop(self):
+        self.indexer.stop()
@@ -49,6 +49,13 @@ class SpiceConsole(QWidget):
     def set_editor_focus(self):
         pass
 
+    def complete(self, text, callback):
+        """Asks for the completions of text, callback(text, matches, start) may be called later.
+
+        Returns False if the console cannot complete, matches replace text[start:].
+        """
+        return False
+
 
 class JupyterConsole(SpiceConsole):
 
@@ -87,9 +94,32 @@ class JupyterConsole(SpiceConsole):
         self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.done.emit)
 
+        # Completions asked by the editor, by message id, and the answers by text.
+        # The answers are forgotten when some code runs, it can define new names
+        self.completion_requests = {}
+        self.completions = {}
+        kernel_client.shell_channel.message_received.connect(self.complete_reply)
+
     def set_editor_focus(self):
         self.jupyter_widget._control.setFocus()
 
+    def complete(self, text, callback):
+        if text in self.completions:
+            callback(text, *self.completions[text])
+        else:
+            msg_id = self.jupyter_widget.kernel_client.complete(text, len(text))
+            self.completion_requests[msg_id] = text, callback
+        return True
+
+    def complete_reply(self, msg):
+        request = self.completion_requests.pop(msg["parent_header"].get("msg_id"), None)
+        if request is None or msg["content"].get("status") != "ok":
+            return
+        text, callback = request
+        content = msg["content"]
+        self.completions[text] = content["matches"], content["cursor_start"]
+        callback(text, *self.completions[text])
+
     def config_read(self):
         pass
 
@@ -111,7 +141,7 @@ class JupyterConsole(SpiceConsole):
             self.jupyter_widget.set_default_style(colors='lightbg')
 
     def execute(self, code, clear=True):
-
+        self.completions.clear()
 
         # self.jupyter_widget._control.setText("")
         # def filtering():
@@ -1,12 +1,15 @@
+import bisect
 import random
 import re
 
 import autopep8
 from PyQt5 import QtGui
-from PyQt5.QtCore import pyqtSignal, Qt, QTimer, QMimeData, QSize, QRect
+from PyQt5.QtCore import pyqtSignal, Qt, QTimer, QMimeData, QSize, QRect, QStringListModel
 from PyQt5.QtGui import QFont, QFontMetrics, QColor, QPainter, QTextCursor, QTextFormat
-from PyQt5.QtWidgets import QTextEdit, QHBoxLayout, QScrollBar, QApplication, QWidget, QPlainTextEdit
+from PyQt5.QtWidgets import QTextEdit, QHBoxLayout, QScrollBar, QApplication, QWidget, QPlainTextEdit, \
+    QCompleter
 
+from spiceditor.autocomplete import WordIndex
 from spiceditor.line_number_text_edit import LineNumberTextEdit
 from spiceditor.magic_scrollbar import MagicScrollBar
 
@@ -29,6 +32,11 @@ class SpiceMagicEditor(QPlainTextEdit):
     ctrl_shift_enter = pyqtSignal()
     info = pyqtSignal(str, int, int)
 
+    # Milliseconds the popup waits for the names of the kernel
+    KERNEL_TIMEOUT = 150
+    # Only the best candidates go to the popup
+    POPUP_SIZE = 50
+
     def __init__(self, highlighter=None, font_size=18):
         super().__init__()
         self.line_number_area_text_color = QColor(120, 120, 120)
@@ -41,6 +49,9 @@ class SpiceMagicEditor(QPlainTextEdit):
         self.count = 0
         self.mode = 0
         self.code = ""
+        self.line_starts = []
+        self.next_nonblank = []
+        self.map_lines()
         self.delay = 0.01
         self.autocomplete_words = []
 
@@ -65,8 +76,30 @@ class SpiceMagicEditor(QPlainTextEdit):
         #        self.textChanged.connect(self.text_changed)
         #        self.horizontalScrollBar().rangeChanged.connect(self.text_changed)
 
+        # Words for autocompletion, kept up to date as the document changes
+        self.words = WordIndex()
+        self.words.attach(self.document())
+        self.update_static_words()
+
+        # In magic mode the program is revealed at the end of the document, whatever the user clicked
+        self.reveal_cursor = QTextCursor(self.document())
+
+        # Ranked candidates in a popup, the kernel can add names if it answers in time
+        self.completion_provider = None
+        self.completion_text = None
+        self.completer = QCompleter(self)
+        self.completer.setWidget(self)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.setModel(QStringListModel(self.completer))
+        self.completer.activated[str].connect(self.insert_completion)
+        self.kernel_timer = QTimer(self)
+        self.kernel_timer.setSingleShot(True)
+        self.kernel_timer.timeout.connect(self.show_completions)
+
         if self.highlighter:
             self.highlighter.setDocument(self.document())
+            self.document().contentsChange.connect(self.highlighter.contents_changed)
+            self.verticalScrollBar().valueChanged.connect(lambda: self.highlighter.center_on(self.firstVisibleBlock()))
 
         self.set_font_size(font_size)
 
@@ -112,8 +145,15 @@ class SpiceMagicEditor(QPlainTextEdit):
             self.line_number_area_text_color = QColor(120, 120, 120)
             self.line_color = QColor(Qt.blue).lighter(190)
 
-        self.highlighter.set_dark_mode(dark)
-        self.highlighter.setDocument(self.document())
+        # Setting the document again would color every block at once, big files are colored
+        # in the background as when they are loaded, and only if the colors change
+        if dark != self.highlighter.dark:
+            self.highlighter.set_dark_mode(dark)
+            if self.blockCount() > self.highlighter.DEFER_LINES:
+                self.highlighter.defer()
+                self.highlighter.resume(self.firstVisibleBlock())
+            else:
+                self.highlighter.rehighlight()
 
     def set_text(self, text):
         self.setPlainText(text)
@@ -188,15 +228,42 @@ class SpiceMagicEditor(QPlainTextEdit):
     def append_autocomplete(self, words, clear=False):
         if clear:
             self.autocomplete_words.clear()
-        self.autocomplete_words += words if words else ""
+        # The configuration gives a string, it used to be added one character at a time
+        if isinstance(words, str):
+            words = WordIndex.WORD.findall(words)
+        self.autocomplete_words += words if words else []
+        self.update_static_words()
+
+    def set_completion_provider(self, provider):
+        # Anything with complete(text, callback), usually the console
+        self.completion_provider = provider
+
+    def update_static_words(self):
+        keywords = self.highlighter.get_keywords() if self.highlighter else []
+        self.words.set_static(set(keywords + self.autocomplete_words))
 
     def set_code(self, code):
         self.setText("")
         self.count = 0
         self.code = code
+        self.map_lines()
         self.set_mode(1)
         self.setFocus()
 
+    def map_lines(self):
+        # Where every line of the code starts and, for every line, the first one from there
+        # that is not blank, so the hints of magic mode do not split the code at each key
+        lines = self.code.split("\n")
+        self.line_starts = [0]
+        for line in lines[:-1]:
+            self.line_starts.append(self.line_starts[-1] + len(line) + 1)
+        self.next_nonblank = [None] * (len(lines) + 1)
+        for i in range(len(lines) - 1, -1, -1):
+            self.next_nonblank[i] = lines[i] if lines[i].strip() else self.next_nonblank[i + 1]
+
+    def line_of(self, position):
+        return bisect.bisect_right(self.line_starts, position) - 1
+
     def set_mode(self, mode):
         self.mode = mode
         self.setCursorWidth(3 if self.mode == 1 else 1)
@@ -210,8 +277,7 @@ class SpiceMagicEditor(QPlainTextEdit):
         self.info.emit(self.get_next_line(), self.get_remaining_chars(), 20)
         if self.count < len(self.code):
             # self.setText(self.toPlainText() + self.code[self.count])
-            self.insertPlainText(self.code[self.count])
-            self.moveCursor(QtGui.QTextCursor.End)
+            self.reveal(self.code[self.count])
             self.count += 1
 
             if self.code[self.count - 1] == "\n":
@@ -225,13 +291,10 @@ class SpiceMagicEditor(QPlainTextEdit):
             QTimer.singleShot(delay, self.complete_line)
 
     def get_rest_of_line(self):
-        count = self.count
-        text = ""
-        while count < len(self.code):
-            text += self.code[count]
-            count += 1
-            if self.code[count - 1] == "\n":
-                return text[1:]
+        # From the character after the next one to the end of the line, newline included
+        line = self.line_of(self.count) + 1
+        if line < len(self.line_starts) and self.count < len(self.code):
+            return self.code[self.count + 1:self.line_starts[line]]
         return ""
 
     def get_spaces(self, line):
@@ -251,15 +314,30 @@ class SpiceMagicEditor(QPlainTextEdit):
         return current_line
 
     def append_next_char(self):
+        self.reveal(self.code[self.count])
         self.count += 1
-        self.setText(self.code[:self.count])
-        self.moveCursor(QtGui.QTextCursor.End)
+
+    def reveal(self, text):
+        # Only the new text is inserted, so the highlighter and the undo stack see a one character edit
+        # instead of a new document. The cursor goes back to the end in case the text was replaced
+        self.reveal_cursor.movePosition(QTextCursor.End)
+        self.reveal_cursor.insertText(text)
+        self.setTextCursor(self.reveal_cursor)
 
     def setText(self, text):
         self.blockSignals(True)
-        super().setPlainText(text)
+        self.setPlainText(text)
         self.blockSignals(False)
 
+    def setPlainText(self, text):
+        # Big files are painted at once and colored in the background, visible lines first
+        defer = self.highlighter is not None and text.count("\n") > self.highlighter.DEFER_LINES
+        if defer:
+            self.highlighter.defer()
+        super().setPlainText(text)
+        if defer:
+            self.highlighter.resume(self.firstVisibleBlock())
+
     def show_all_code(self):
         self.setText(self.code)
         self.set_mode(0)
@@ -307,22 +385,26 @@ class SpiceMagicEditor(QPlainTextEdit):
             elif e.key() == Qt.Key_Backspace:
                 self.set_mode(0)
             else:
-                self.setText(self.toPlainText() + "\n")
-                self.moveCursor(QtGui.QTextCursor.End)
+                self.reveal("\n")
 
         elif self.mode == 0:
 
-            if e.key() == Qt.Key_Tab:
+            if self.completer.popup().isVisible() and e.key() in (Qt.Key_Return, Qt.Key_Enter, Qt.Key_Tab,
+                                                                  Qt.Key_Backtab, Qt.Key_Escape):
+                # The completer picks or closes
+                e.ignore()
+                return
+            elif e.key() == Qt.Key_Tab:
                 self.tab_pressed()
             elif e.key() == Qt.Key_Backspace:
-                self.suggestion = None
+                self.cancel_completion()
                 if self.get_current_line_text().endswith("    "):
                     for i in range(4):
                         self.textCursor().deletePreviousChar()
                 else:
                     super().keyPressEvent(e)
             elif e.key() == Qt.Key_Return:
-                self.suggestion = None
+                self.cancel_completion()
                 if e.modifiers() == Qt.ControlModifier:
                     self.ctrl_enter.emit()
                 elif e.modifiers() == (Qt.ControlModifier | Qt.ShiftModifier):
@@ -332,7 +414,7 @@ class SpiceMagicEditor(QPlainTextEdit):
                 else:
                     super().keyPressEvent(e)
             else:
-                self.suggestion = None
+                self.cancel_completion()
                 super().keyPressEvent(e)
         self.cursorPositionChanged.emit()
 
@@ -364,76 +446,81 @@ class SpiceMagicEditor(QPlainTextEdit):
             self.indent_selected()
             return
 
-        # Let see if we have some autocomplete candidates
-        if self.suggestion is None:
-            current_words = re.split(r'\W+', self.toPlainText())
-            text_before_cursor = self.get_text_before_cursor()
-            words_before_cursos = re.split(r"[+\-*/= ]", text_before_cursor)
-            self.candidates = []
-            if words_before_cursos[-1] != "":
-                word_set = list(set(current_words + self.highlighter.get_keywords() + self.autocomplete_words))
-                self.candidates = [word for word in word_set if word.startswith(words_before_cursos[-1])]
-                if words_before_cursos[-1] in self.candidates:
-                    self.candidates.remove(words_before_cursos[-1])
-                    self.candidates.append(words_before_cursos[-1])
-                self.suggestion = words_before_cursos[-1]
-
-        print("CANDIDATES:", self.candidates)
-        if len(self.candidates) > 1:
-
-            # Remove the current suggestion
-            for _ in range(len(self.suggestion)):
-                self.textCursor().deletePreviousChar()
-
-            self.suggestion = self.candidates.pop(0)
-            self.candidates.append(self.suggestion)
-            print("Suggestion:", self.suggestion)
-            self.insertPlainText(self.suggestion)
-        else:
+        # The word before the cursor is completed, the kernel gets the whole line
+        self.cancel_completion()
+        text = self.get_text_before_cursor()
+        prefix = re.search(r"\w*$", text).group()
+        if not prefix:
             self.insertPlainText("    ")
+            return
+
+        self.suggestion = prefix
+        self.completion_text = text
+        self.candidates = self.words.rank(prefix, self.textCursor().blockNumber())
+        self.kernel_timer.start(self.KERNEL_TIMEOUT)
+        if self.completion_provider is None or not self.completion_provider.complete(text, self.kernel_reply):
+            self.show_completions()
 
-        # if len(self.candidates) > 0:
-
-        # current_line = self.get_current_line_text()
-        #
-        # # it was just a tab
-        # if len(current_line) == 0 or current_line.endswith("    "):
-        #     self.insertPlainText("    ")
-        #     self.moveCursor(QtGui.QTextCursor.End)
-        #     self.suggestion = None
-        #     return
-        #
-        # # it was just a tab
-        # if len(current_line) > 0 and current_line[-1] in " (:)":
-        #     self.suggestion = None
-        #     return
-        #
-        # if self.suggestion is None:
-        #
-        #     if len(self.candidates) == 0:
-        #         self.insertPlainText("    ")
-        #         return
-        #     elif len(self.candidates) == 1:
-        #         self.insertPlainText(self.candidates[0][len(unfinished_word):])
-        #         self.moveCursor(QtGui.QTextCursor.End)
-        #         return
-        #     else:
-        #         self.suggestion = unfinished_word
-        #
-        # for _ in range(len(self.suggestion)):
-        #     self.textCursor().deletePreviousChar()
-        # self.candidates.append(self.suggestion)
-        # self.suggestion = self.candidates.pop(0)
-        # self.insertPlainText(self.suggestion)
+    def kernel_reply(self, text, matches, start):
+        # Late answers are for a line that may have changed
+        if self.suggestion is None or text != self.completion_text:
+            return
+
+        # The matches replace text[start:], only what completes the word is kept
+        offset = len(text) - len(self.suggestion)
+        names = []
+        for match in matches:
+            if start <= offset:
+                name = match[offset - start:] if match.startswith(text[start:offset]) else ""
+            else:
+                name = text[offset:start] + match
+            if WordIndex.WORD.fullmatch(name):
+                names.append(name)
+
+        # After a dot the words of the buffer are unrelated guesses, the kernel knows the attributes
+        attribute = text[:offset].endswith(".") and len(names) > 0
+        self.candidates = self.words.rank(self.suggestion, self.textCursor().blockNumber(), names, not attribute)
+        if self.kernel_timer.isActive():
+            self.show_completions()
+        elif self.completer.popup().isVisible():
+            self.completer.model().setStringList(self.candidates[:self.POPUP_SIZE])
+            self.completer.popup().setCurrentIndex(self.completer.model().index(0, 0))
+
+    def show_completions(self):
+        self.kernel_timer.stop()
+        if self.suggestion is None or self.get_text_before_cursor() != self.completion_text:
+            self.cancel_completion()
+        elif not self.candidates:
+            self.suggestion = None
+            self.insertPlainText("    ")
+        elif len(self.candidates) == 1:
+            self.insert_completion(self.candidates[0])
+        else:
+            model = self.completer.model()
+            model.setStringList(self.candidates[:self.POPUP_SIZE])
+            popup = self.completer.popup()
+            rect = self.cursorRect()
+            rect.setWidth(popup.sizeHintForColumn(0) + popup.verticalScrollBar().sizeHint().width())
+            self.completer.complete(rect)
+            popup.setCurrentIndex(model.index(0, 0))
+
+    def insert_completion(self, word):
+        if self.suggestion is None:
+            return
+        cursor = self.textCursor()
+        cursor.movePosition(QTextCursor.Left, QTextCursor.KeepAnchor, len(self.suggestion))
+        cursor.insertText(word)
+        self.setTextCursor(cursor)
+        self.words.touch(word)
+        self.suggestion = None
+
+    def cancel_completion(self):
+        self.kernel_timer.stop()
+        self.completer.popup().hide()
+        self.suggestion = None
 
     def get_next_line(self):
-        count = self.count
-        remaining = self.code[count:]
-        remaining = remaining.split("\n")
-        remaining = remaining[1:]
-        remaining = [x for x in remaining if x.strip()]
-        if remaining:
-            return remaining[0]
+        return self.next_nonblank[self.line_of(self.count) + 1]
 
 
 class PascalEditor(SpiceMagicEditor):
@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 import argparse
+import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from io import BytesIO
+from itertools import repeat
+
+import fitz  # PyMuPDF
 
 from PyPDF2 import PdfReader, PdfWriter
 from reportlab.lib.colors import Color, white
 from reportlab.pdfgen import canvas
 
 
-def add_text_to_page(page, text, position, page_size):
+@lru_cache(maxsize=None)
+def overlay(text, position, page_size):
+    # The badge of a page number is the same for every page of that size, build it once
     packet = BytesIO()
     can = canvas.Canvas(packet, pagesize=page_size)
     custom_color = Color(0.894, 0.118, 0.118)
@@ -27,92 +36,271 @@ def add_text_to_page(page, text, position, page_size):
     can.save()
 
     packet.seek(0)
-    new_pdf = PdfReader(packet)
-    overlay_page = new_pdf.pages[0]
+    return PdfReader(packet).pages[0]
+
 
-    page.merge_page(overlay_page)
+def add_text_to_page(page, text, position, page_size):
+    page.merge_page(overlay(text, tuple(position), tuple(float(x) for x in page_size)))
     return page
 
-def process_pdf(input_path, base_output_path, suffix, exclude):
-    reader = PdfReader(input_path)
-    output_count = 0
-    writer = None
-    count = 1
+
+class Rules:
+    """What starts a section, how its file is named and which pages are left out.
+
+    Start and exclusion patterns are searched in the whole text of a page,
+    ignoring case. Name rules are searched line by line, their template can
+    use the groups of the match ({0}, {1}...), the stripped line ({line}) and
+    the following one ({next}). When several name rules match a page the
+    last rule wins, as does the last matching line of a rule.
+    """
+
+    DEFAULT = {
+        "start": ["Grado en Estudios para la Defensa y Seguridad"],
+        "names": [
+            {"pattern": r"^(?=.*BLOQUE)(?=.*TEMA)\D*(\d+)\D*(\d+)", "template": "B{1}_T{2}_{next}"},
+            {"pattern": r"LAB:", "template": "{line}"},
+        ],
+        "exclude": [],
+    }
+
+    def __init__(self, start=(), names=(), exclude=()):
+        self.start = [re.compile(p, re.IGNORECASE) for p in start]
+        self.exclude = [re.compile(p, re.IGNORECASE) for p in exclude]
+        self.names = [(re.compile(r["pattern"], re.IGNORECASE if r.get("ignore_case") else 0), r["template"])
+                      for r in names]
+
+        # Lines that match no rule at all are skipped with a single search
+        alternatives = ["(?{}:{})".format("i" if regex.flags & re.IGNORECASE else "", regex.pattern)
+                        for regex, _ in self.names]
+        self.any_name = re.compile("|".join(alternatives)) if alternatives else None
+
+    @classmethod
+    def load(cls, path=None, exclude=None):
+        data = dict(cls.DEFAULT)
+        if path is not None:
+            with open(path, encoding="utf-8") as f:
+                data.update(json.load(f))
+        excluded = list(data.get("exclude", []))
+        if exclude is not None:
+            excluded.append(re.escape(exclude))
+        return cls(data.get("start", []), data.get("names", []), excluded)
+
+    def is_start(self, text):
+        return any(regex.search(text) for regex in self.start)
+
+    def is_excluded(self, text):
+        return any(regex.search(text) for regex in self.exclude)
+
+    def name(self, lines):
+        found = [None] * len(self.names)
+        for n, line in enumerate(lines):
+            if self.any_name is None or not self.any_name.search(line):
+                continue
+            for r, (regex, template) in enumerate(self.names):
+                m = regex.search(line)
+                if m:
+                    next_line = lines[n + 1].strip() if n + 1 < len(lines) else ""
+                    found[r] = template.format(m.group(0), *m.groups(), line=line.strip(), next=next_line)
+        names = [name for name in found if name is not None]
+        return names[-1] if names else None
+
+
+def plan_sections(texts, rules, base_output_path, suffix, name=""):
+    """Splits the pages of a document given their text, yields (filename, page indexes).
+
+    Sections are yielded as soon as the next one starts, so with a lazy
+    iterable of texts they can be written while the document is still read.
+    """
+    count = 0
+    pages = None
     filename = None
 
-    for i, page in enumerate(reader.pages):
-        page_text = page.extract_text()
+    for i, page_text in enumerate(texts):
+        # Every page is split in lines once and goes through all the rules
+        if rules.is_start(page_text):
+            if pages:
+                yield section_name(base_output_path, filename, suffix, name, count), pages
+                count += 1
+            pages = []
+            filename = None
+
+        filename = rules.name(page_text.split("\n")) or filename
+
+        if pages is not None and not rules.is_excluded(page_text):
+            pages.append(i)
+
+    if pages:
+        yield section_name(base_output_path, filename, suffix, name, count), pages
+
+
+def section_name(base_output_path, filename, suffix, name, count):
+    if filename is None:
+        return f"{base_output_path}{name}_{count}{suffix}.pdf"
+    return base_output_path + filename + suffix + ".pdf"
+
+
+def write_section(reader, filename, pages):
+    writer = PdfWriter()
+    for count, i in enumerate(pages, 1):
+        page = reader.pages[i]
         page_size = (page.mediabox.width, page.mediabox.height)
+        add_text_to_page(page, str(count) if count > 2 else "", (930, 6), page_size)
+        writer.add_page(page)
 
-        #print(page_text)
-        if "Grado en Estudios para la Defensa y Seguridad".lower() in page_text.lower():
-            if writer is not None and len(writer.pages) > 0:
-                print("filename: ", filename)
+    with open(filename, "wb") as output_file:
+        writer.write(output_file)
 
-                if filename is None:
-                    filename = f"{base_output_path}_{output_count}{suffix}.pdf"
-                else:
-                    filename = base_output_path + filename + suffix + ".pdf"
-                with open(filename, "wb") as output_file:
-                    writer.write(output_file)
-                    filename = None
 
-                output_count += 1
+def add_badge(page, text, position):
+    # Same badge as the reportlab overlay, position is from the bottom left corner
+    color = (0.894, 0.118, 0.118)
+    x, y = position[0], page.rect.height - position[1]
+    page.draw_rect(fitz.Rect(x - 10, y - 15, x + 25, y + 5), color=color, fill=color)
+    if text:
+        page.insert_text((x, y), text, fontname="hebo", fontsize=16, color=(1, 1, 1))
 
-            writer = PdfWriter()
-            count = 1
 
+def page_runs(pages):
+    # Consecutive pages are copied with a single insert_pdf call
+    start = prev = pages[0]
+    for i in pages[1:]:
+        if i != prev + 1:
+            yield start, prev
+            start = i
+        prev = i
+    yield start, prev
 
-        if "bloque" in page_text.lower() and "tema" in page_text.lower():
-            for line in page_text.split("\n"):
-                if "BLOQUE" in line and "TEMA" in line:
-                    matches = re.findall(r'\d+', line)
-                    next_line = page_text.split("\n")[page_text.split("\n").index(line) + 1]
-                    block = matches[0]  # Extracts '2'
-                    topic = matches[1]  # Extracts '5'
 
-                    filename = f"B{block}_T{topic}_{next_line.strip()}"
+def write_section_mupdf(doc, filename, pages):
+    output = fitz.open()
+    for start, end in page_runs(pages):
+        output.insert_pdf(doc, from_page=start, to_page=end)
+    for count, page in enumerate(output, 1):
+        add_badge(page, str(count) if count > 2 else "", (930, 6))
+    output.save(filename, garbage=3, deflate=True)
+    output.close()
 
 
+def process_pdf(input_path, base_output_path, suffix, rules, name="", backend="pypdf", dry_run=False):
+    """Splits a PDF, returns its sections as (filename, page indexes).
 
-        if "LAB:" in page_text:
-            for line in page_text.split("\n"):
-                if "LAB:" in line:
-                    filename = line.strip()
+    Nothing is printed here, the workers of a batch would mix their lines.
+    """
+    if backend == "mupdf":
+        source = fitz.open(input_path)
+        texts = (page.get_text() for page in source)
+        write = write_section_mupdf
+    else:
+        source = PdfReader(input_path)
+        texts = (page.extract_text() for page in source.pages)
+        write = write_section
 
+    # The text of every page is extracted once, sections are written as soon as they end
+    plan = []
+    try:
+        for filename, pages in plan_sections(texts, rules, base_output_path, suffix, name):
+            if not dry_run:
+                write(source, filename, pages)
+            plan.append((filename, pages))
+    finally:
+        if backend == "mupdf":
+            source.close()
+    return plan
+
+
+def print_plan(input_path, plan, dry_run=False):
+    for filename, pages in plan:
+        if dry_run:
+            print(f"{input_path}: filename: ", filename, "pages:", ", ".join(
+                str(start + 1) if start == end else f"{start + 1}-{end + 1}" for start, end in page_runs(pages)))
+        else:
+            print(f"{input_path}: filename: ", filename)
+
+
+def write_plan(input_path, plan, backend="pypdf"):
+    """Writes the sections planned by a dry run of process_pdf."""
+    if backend == "mupdf":
+        with fitz.open(input_path) as source:
+            for filename, pages in plan:
+                write_section_mupdf(source, filename, pages)
+    else:
+        reader = PdfReader(input_path)
+        for filename, pages in plan:
+            write_section(reader, filename, pages)
 
-        if writer is not None:
-            if exclude is not None and exclude.lower() in page_text.lower():
-                continue
 
-            if count > 2:
-                new_page = add_text_to_page(page, str(count), (930, 6), page_size)
-            else:
-                new_page = add_text_to_page(page, "", (930, 6), page_size)
-            writer.add_page(new_page)
-            count = count + 1
+def document_names(files):
+    # Prefixes of the sections of each document, files with the same name in different folders get a number
+    names = []
+    for f in files:
+        stem = os.path.splitext(os.path.basename(f))[0]
+        name, n = stem, 2
+        while name in names:
+            name, n = f"{stem}{n}", n + 1
+        names.append(name)
+    return names
+
+
+def rename_duplicates(plans, names, base_output_path):
+    # Named sections found in several documents get the name of their document as prefix
+    owners = {}
+    for i, plan in enumerate(plans):
+        for filename, _ in plan:
+            owners.setdefault(filename, set()).add(i)
+    return [[(filename if len(owners[filename]) == 1
+              else base_output_path + name + "_" + filename[len(base_output_path):], pages)
+             for filename, pages in plan]
+            for plan, name in zip(plans, names)]
+
+
+def process_batch(files, base_output_path, suffix, rules, jobs=None, backend="pypdf", dry_run=False):
+    """Splits many PDFs in parallel, one process per document.
+
+    With several documents all of them are planned before anything is
+    written, so that sections with the same name in different documents get
+    the name of their document as prefix instead of overwriting each other.
+    """
+    if len(files) == 1:
+        plan = process_pdf(files[0], base_output_path, suffix, rules, "", backend, dry_run)
+        print_plan(files[0], plan, dry_run)
+        return [plan]
+
+    # Unnamed sections of different documents must not overwrite each other
+    names = document_names(files)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        run = map if jobs == 1 else executor.map
+        plans = list(run(process_pdf, files, repeat(base_output_path), repeat(suffix), repeat(rules), names,
+                         repeat(backend), repeat(True)))
+        plans = rename_duplicates(plans, names, base_output_path)
+
+        # The plans are printed here, in order, as the documents are done
+        done = repeat(None) if dry_run else run(write_plan, files, plans, repeat(backend))
+        for f, plan, _ in zip(files, plans, done):
+            print_plan(f, plan, dry_run)
+    return plans
 
-    if writer is not None and len(writer.pages) > 0:
-        if filename is None:
-            filename = f"{base_output_path}_{output_count}.pdf"
-        with open(filename, "wb") as output_file:
-            writer.write(output_file)
 
 def main():
     # add switches instead of positional arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument("file", help="Suffix to add to the output files", type=str)
-    parser.add_argument("dir", help="Suffix to add to the output files", type=str)
+    parser.add_argument("files", help="PDF files to split", type=str, nargs="+")
+    parser.add_argument("dir", help="Output directory", type=str)
     parser.add_argument("-s", "--suffix", help="Suffix to add to the output files", type=str, default="")
     parser.add_argument("-x", "--exclude", help="Exclude pages with this text", type=str, default=None)
+    parser.add_argument("-j", "--jobs", help="Number of processes, defaults to the number of cores", type=int,
+                        default=None)
+    parser.add_argument("-b", "--backend", help="Library used to read and write the PDFs", type=str,
+                        choices=["pypdf", "mupdf"], default="pypdf")
+    parser.add_argument("-r", "--rules", help="JSON file with the start, names and exclude rules", type=str,
+                        default=None)
+    parser.add_argument("-n", "--dry-run", help="Print the sections without writing them", action="store_true")
 
     args = parser.parse_args()
 
     suffix = ("_" if args.suffix != "" else "")  + args.suffix
 
-    process_pdf(args.file, args.dir +"/", suffix , args.exclude)
+    rules = Rules.load(args.rules, args.exclude)
+    process_batch(args.files, args.dir + "/", suffix, rules, args.jobs, args.backend, args.dry_run)
 
 if __name__ == "__main__":
     main()
-
-
@@ -1,3 +1,4 @@
+import math
 import os
 import platform
 import subprocess
@@ -7,15 +8,19 @@ import fitz  # PyMuPDF
 import sys
 
 import fitz  # PyMuPDF
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QLine, QLineF, QRectF, QPointF
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QLine, QLineF, QRectF, QPointF, QSizeF
 from PyQt5.QtGui import QPixmap, QImage, QFont, QPainter, QColor, QCursor, QIcon, QTransform, QPen
 from PyQt5.QtWidgets import QMainWindow, QLabel, QSizePolicy, QApplication, QVBoxLayout, QWidget, QPushButton, \
-    QShortcut, QInputDialog, QTabBar, QToolBar, QHBoxLayout, QComboBox, QGraphicsView, QGraphicsScene, \
+    QShortcut, QInputDialog, QFileDialog, QTabBar, QToolBar, QHBoxLayout, QComboBox, QGraphicsView, QGraphicsScene, \
     QGraphicsPixmapItem, QGraphicsItem, QGraphicsEllipseItem, \
     QGraphicsRectItem, QGraphicsProxyWidget, QGraphicsLineItem
-from pymupdf import Rect
-from scipy.signal import savgol_filter
 
+from spiceditor.annotations import Stroke, Rectangle, Ellipse, PageDrawings, AnnotationStore, smooth_with_savgol, \
+    simplify, burn_in
+from spiceditor.page_map import PageMap
+from spiceditor.page_cache import RenderCache, PageRenderer, render_page
+from spiceditor.thumbnails import ThumbnailStrip
+from spiceditor.slide_index import SlideIndexer, IndexStore, extract_code_blocks, load_code_index
 from spiceditor.utils import create_cursor_image
 
 
@@ -23,16 +28,6 @@ class Eraser(QGraphicsEllipseItem):
     pass
 
 
-def smooth_with_savgol(points, window_size=10, poly_order=2):
-    if len(points) < window_size:
-        return points
-    x = [p[0] for p in points]
-    y = [p[1] for p in points]
-    smoothed_x = savgol_filter(x, window_size, poly_order)
-    smoothed_y = savgol_filter(y, window_size, poly_order)
-    return list(zip(smoothed_x, smoothed_y))
-
-
 class GraphicsScene(QGraphicsScene):
     NONE = 0
     POINTER = 1
@@ -43,6 +38,10 @@ class GraphicsScene(QGraphicsScene):
 
     navigate = pyqtSignal(int)
 
+    # Maximum deviation, in scene units, allowed when simplifying strokes
+    SIMPLIFY_TOLERANCE = 0.5
+    SAVE_DELAY = 1000
+
     def keyPressEvent(self, event):
         super().keyPressEvent(event)
         if event.key() == Qt.Key_E:
@@ -56,35 +55,53 @@ class GraphicsScene(QGraphicsScene):
 
     def __init__(self):
         super().__init__()
-        self.handwriting = []
+        self.stroke = None
         self.pixmap = QGraphicsPixmapItem()
         self.pixmap.setTransformationMode(Qt.SmoothTransformation)  # Enable smooth transformation for the pixmap item
 
         self.addItem(self.pixmap)
         self.image = None
+        self.image_size = QSizeF()
         self.start = None
         self.page = 0
         self.status = GraphicsScene.NONE
 
-        self.gum = Eraser(0, 0, 100, 100, self.pixmap)
+        self.gum = Eraser(0, 0, 100, 100)
+        self.addItem(self.gum)
         self.gum.setBrush(QColor(255, 255, 255))
         self.gum.setPen(QPen(QColor(0, 0, 0), 2))
         self.gum.setVisible(False)
         self.drawings = {}
+
+        # Modified pages are handed to the store once drawing pauses
+        self.store = None
+        self.dirty = set()
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(self.SAVE_DELAY)
+        self.save_timer.timeout.connect(self.save_dirty)
         self.rectangle = None
         self.color = QPen(Qt.black, 2)
         # make the ellipse movable
         # self.gum.setFlag(QGraphicsItem.ItemIsMovable)
 
-    def set_image(self, image, page):
-        current = self.drawings.get(self.page, [])
-        for item in current:
+    def set_image(self, image, page, scale=1.0):
+        for item in self.drawings.get(self.page, []):
             self.removeItem(item)
 
         self.image = image
         self.page = page
-        # self.resize_image(size)
+        # The pixmap may be rendered at any resolution, the scale maps it
+        # back to scene coordinates so that drawings and buttons stay put
+        self.image_size = QSizeF(image.width() * scale, image.height() * scale)
         self.pixmap.setPixmap(self.image)
+        self.pixmap.setScale(scale)
+
+        # Saved drawings are only read when the page is shown for the first time
+        if self.page not in self.drawings and self.store is not None and isinstance(self.page, int):
+            drawings = self.page_drawings()
+            for item in self.store.load(self.page):
+                drawings.add(item)
 
         for item in self.drawings.get(self.page, []):
             self.addItem(item)
@@ -105,40 +122,35 @@ class GraphicsScene(QGraphicsScene):
                 return
 
         if self.status == GraphicsScene.WRITING:
-            self.handwriting.clear()
+            self.stroke = Stroke(self.color, self.start)
+            self.addItem(self.stroke)
 
         elif self.status == GraphicsScene.RECTANGLES:
-            self.rectangle = self.addRect(QRectF(self.start, self.start), self.color)
+            self.rectangle = Rectangle(QRectF(self.start, self.start), self.color)
 
         elif self.status == GraphicsScene.ELLIPSES:
-            self.rectangle = self.addEllipse(QRectF(self.start, self.start), self.color)
+            self.rectangle = Ellipse(QRectF(self.start, self.start), self.color)
 
         if self.rectangle is not None:
-            self.rectangle.setFlag(QGraphicsItem.ItemIsMovable)
-            if self.drawings.get(self.page, None) is None:
-                self.drawings[self.page] = []
-            self.drawings[self.page].append(self.rectangle)
+            self.addItem(self.rectangle)
+            self.page_drawings().add(self.rectangle)
 
     def mouseMoveEvent(self, event):
         super().mouseMoveEvent(event)
         if self.status == GraphicsScene.WRITING:
-            if self.start is None:
+            if self.stroke is None:
                 return
-
-            line = self.addLine(QLineF(self.start, event.scenePos()), self.color)
-            self.handwriting.append(line)
-            self.start = event.scenePos()
+            self.stroke.add_point(event.scenePos())
 
         elif self.status == GraphicsScene.ERASING:
             if self.start is not None:
                 self.gum.setPos(event.scenePos() - QLine(50, 50, 50, 50).p2())
-                colliding = self.gum.collidingItems()
-                for item in colliding:
-                    if type(item) in [QGraphicsPixmapItem, QGraphicsProxyWidget]:
-                        continue
-                    if item in self.drawings.get(self.page, []):
-                        self.drawings[self.page].remove(item)
+                drawings = self.page_drawings()
+                for item in drawings.query(self.gum.sceneBoundingRect()):
+                    if item.collidesWithItem(self.gum):
+                        drawings.remove(item)
                         self.removeItem(item)
+                        self.modified()
 
         elif self.status in [GraphicsScene.RECTANGLES, GraphicsScene.ELLIPSES]:
             if self.start is None:
@@ -147,6 +159,11 @@ class GraphicsScene(QGraphicsScene):
 
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
+        if self.rectangle is not None:
+            # Dragged up or left the rectangle has a negative size
+            self.rectangle.setRect(self.rectangle.rect().normalized())
+            self.page_drawings().update(self.rectangle)
+            self.modified()
         self.start = None
         self.rectangle = None
 
@@ -154,28 +171,54 @@ class GraphicsScene(QGraphicsScene):
             self.smooth_handwriting()
 
     def smooth_handwriting(self):
-        points = []
-        for p in self.handwriting:  # type: QGraphicsLineItem
-            points.append((p.line().x1(), p.line().y1()))
+        stroke, self.stroke = self.stroke, None
+        if stroke is None:
+            return
 
-        for line in self.handwriting:
-            self.removeItem(line)
+        if len(stroke) < 2:
+            self.removeItem(stroke)
+            return
 
-        smoothed = smooth_with_savgol(points, 20, 4)
+        smoothed = smooth_with_savgol(stroke.points, 20, 4)
+        stroke.set_points(simplify(smoothed, self.SIMPLIFY_TOLERANCE))
 
-        if len(smoothed) > 0:
-            p1 = smoothed[0]
-            for p2 in smoothed[1:]:
-                line = self.addLine(QLineF(QPointF(*p1), QPointF(*p2)), self.color)
-                if self.drawings.get(self.page) is None:
-                    self.drawings[self.page] = []
-                self.drawings[self.page].append(line)
-                p1 = p2
+        self.page_drawings().add(stroke)
+        self.modified()
+
+    def page_drawings(self):
+        if self.page not in self.drawings:
+            self.drawings[self.page] = PageDrawings()
+        return self.drawings[self.page]
+
+    def drawing_moved(self, item):
+        self.page_drawings().update(item)
+        self.modified()
 
     def erase_all(self):
-        for item in self.drawings.get(self.page, []):
+        drawings = self.page_drawings()
+        for item in drawings:
             self.removeItem(item)
-        self.drawings[self.page] = []
+        drawings.clear()
+        self.modified()
+
+    def get_drawings(self, page):
+        # Drawings of any page, reading them from the store if it was never shown
+        drawings = self.drawings.get(page)
+        if drawings is None and self.store is not None and isinstance(page, int):
+            return self.store.load(page)
+        return list(drawings or [])
+
+    def modified(self):
+        # Blank pages are not part of the PDF, their drawings are not saved
+        if self.store is not None and isinstance(self.page, int):
+            self.dirty.add(self.page)
+            self.save_timer.start()
+
+    def save_dirty(self):
+        self.save_timer.stop()
+        for page in self.dirty:
+            self.store.save(page, list(self.drawings.get(page, [])))
+        self.dirty.clear()
 
 
 class GraphicsView(QGraphicsView):
@@ -187,30 +230,47 @@ class GraphicsView(QGraphicsView):
         self.setRenderHint(QPainter.Antialiasing)
         self.setRenderHint(QPainter.TextAntialiasing)
         self.setRenderHint(QPainter.HighQualityAntialiasing)
+        # The page is always fitted, scroll bars would only make fit() oscillate
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         # self.scence = None
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
+        self.fit()
+        self.resized.emit()
+
+    def fit(self):
+        size = self.scene().image_size
+        if size.isEmpty():
+            return
         transf = QTransform()
-        ratio1 = self.viewport().size().width() / self.scene().image.width()
-        ratio2 = self.viewport().size().height() / self.scene().image.height()
+        ratio1 = self.viewport().size().width() / size.width()
+        ratio2 = self.viewport().size().height() / size.height()
         ratio = min(ratio1, ratio2)
         transf.scale(ratio, ratio)
         self.setTransform(transf)
-        self.scene().setSceneRect(0, 0, self.scene().image.width(), self.scene().image.height())
-        self.resized.emit()
+        self.scene().setSceneRect(0, 0, size.width(), size.height())
 
         # if self.scence is not None:
         #    self.scene().removeItem(self.scence)
         # self.scence = self.scene().addRect(self.sceneRect(), QColor(255, 0, 0))
 
-    def set_image(self, image, page):
-        self.scene().set_image(image, page)
+    def set_image(self, image, page, scale=1.0):
+        self.scene().set_image(image, page, scale)
+        self.fit()
 
 
 class Slides(QWidget):
     play_code = pyqtSignal(str)
 
+    # Scene coordinates are PDF points times ZOOM, whatever the render resolution
+    ZOOM = 2
+    ZOOM_STEP = 20
+    RENDER_DELAY = 150
+    PRERENDER = 2
+    CACHE_BUDGET = 256 * 1024 * 1024
+
     def set_writing_mode(self, mode):
         for i, elem in enumerate(self.group):
             elem.blockSignals(True)
@@ -273,6 +333,15 @@ class Slides(QWidget):
         erase_all = toolbar.addAction("", lambda: self.erase_all())
         erase_all.setIcon(QIcon(":/icons/bin.svg"))
 
+        export = toolbar.addAction("", self.export_requested)
+        export.setIcon(QIcon(":/icons/download.svg"))
+        export.setToolTip("Export annotated PDF")
+
+        self.action_thumbnails = toolbar.addAction("", self.toggle_thumbnails)
+        self.action_thumbnails.setIcon(QIcon(":/icons/hash.svg"))
+        self.action_thumbnails.setToolTip("Thumbnails")
+        self.action_thumbnails.setCheckable(True)
+
         toolbar.addSeparator()
         t1 = toolbar.addAction(QIcon(":/icons/minus.svg"), "", lambda: self.set_thickness(0))
         t1.setCheckable(True)
@@ -314,9 +383,59 @@ class Slides(QWidget):
         next1.setIcon(QIcon(":/icons/arrow-right.svg"))
         return toolbar
 
+    def export_requested(self):
+        default = os.path.splitext(self.filename)[0] + "_annotated.pdf"
+        filename, ok = QFileDialog.getSaveFileName(self, "Export annotated PDF", default, "PDF files (*.pdf)")
+        if filename:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                self.export_pdf(filename)
+            finally:
+                QApplication.restoreOverrideCursor()
+
+    def export_pdf(self, filename):
+        """Writes the deck with its drawings burned in as vector graphics.
+
+        Runs of pages without drawings are copied from the original in a
+        single insert_pdf call, nothing is rasterized.
+        """
+        out = fitz.open()
+        run = None
+        for index in range(len(self.page_map)):
+            pdf_page = self.page_map.pdf_page(index)
+            items = self.scene.get_drawings(self.page_map.key(index))
+            if pdf_page is not None and not items:
+                if run is not None and run[1] == pdf_page - 1:
+                    run[1] = pdf_page
+                    continue
+                if run is not None:
+                    out.insert_pdf(self.doc, from_page=run[0], to_page=run[1])
+                run = [pdf_page, pdf_page]
+                continue
+
+            if run is not None:
+                out.insert_pdf(self.doc, from_page=run[0], to_page=run[1])
+                run = None
+
+            if pdf_page is None:
+                # Blank pages take the size of the PDF page next to them
+                group, _ = self.page_map.locate(index)
+                rect = self.doc[min(group, len(self.doc) - 1)].rect
+                page = out.new_page(width=rect.width, height=rect.height)
+            else:
+                out.insert_pdf(self.doc, from_page=pdf_page, to_page=pdf_page)
+                page = out[-1]
+            burn_in(page, items, self.ZOOM)
+
+        if run is not None:
+            out.insert_pdf(self.doc, from_page=run[0], to_page=run[1])
+        out.save(filename, garbage=1, deflate=True)
+        out.close()
+
     def add_empty_page(self):
-        self.page += 1
-        self.pages_number.insert(self.page, None)
+        self.page = self.page_map.insert_blank(self.page)
+        if self.thumbnails is not None:
+            self.thumbnails.populate()
         self.update_image()
 
     def set_thickness(self, thickness):
@@ -341,17 +460,49 @@ class Slides(QWidget):
         self.touchable = True
         self.program = ""
         self.code_buttons = []
+        self.highlights = []
+        self.code_index = {}
+        self.code_buttons_cache = {}
         self.code_line_height = 0
-        self.resized_pixmap = None
+        self.pixmap = None
         self.doc = fitz.open(pdf_path)
-        self.pages_number = [i for i in range(len(self.doc))]
+        self.page_map = PageMap(len(self.doc))
+
+        self.cache = RenderCache(self.CACHE_BUDGET)
+        self.renderer = PageRenderer(pdf_path)
+        self.renderer.rendered.connect(self.page_rendered)
+        self.renderer.start()
+
+        # Reuse the index of a previous session if the PDF did not change
+        self.store = IndexStore()
+        self.index_key = self.store.cached_key(pdf_path)
+        data = self.store.load(self.index_key) if self.index_key is not None else None
+        if data is not None and data.get("pages") == len(self.doc):
+            self.code_index = load_code_index(data)
+
+        self.indexer = SlideIndexer(pdf_path, self.store)
+        self.indexer.indexed.connect(self.page_indexed)
+        self.indexer.done.connect(self.index_done)
+        if len(self.code_index) != len(self.doc):
+            self.indexer.start()
+
+        # Re-render at the new resolution once resizing settles, in the
+        # meantime the view just scales the pixmap it already has
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(self.RENDER_DELAY)
+        self.render_timer.timeout.connect(self.refresh)
 
         self.filename = pdf_path
         self.page = page
         self.base = None
 
         # Create a QLabel to display the image
+        self.annotations = AnnotationStore(pdf_path)
+        self.annotations.start()
+
         self.scene = GraphicsScene()
+        self.scene.store = self.annotations
         self.scene.navigate.connect(self.navigate)
         self.view = GraphicsView(self.scene)
         self.view.resized.connect(self.resized)
@@ -365,14 +516,21 @@ class Slides(QWidget):
 
         # add shortcut ctrl+n to number of page
         def get_number_of_page():
-            a, b = QInputDialog.getInt(self, "Number of page", "Enter the number of page", self.page + 1, 1,
-                                       len(self.doc), 1, Qt.WindowFlags())
-            self.page = a - 1
-            self.update_image()
+            # Numbers refer to the PDF pages, whatever blank pages were inserted
+            pdf_page = self.page_map.pdf_page(self.page)
+            a, ok = QInputDialog.getInt(self, "Number of page", "Enter the number of page",
+                                        (pdf_page or 0) + 1, 1, len(self.doc), 1, Qt.WindowFlags())
+            if ok:
+                self.page = self.page_map.index_of(a - 1)
+                self.update_image()
 
         q = QShortcut("Ctrl+N", self)
         q.activated.connect(get_number_of_page)
 
+        q = QShortcut("Ctrl+T", self)
+        q.activated.connect(lambda: self.action_thumbnails.trigger())
+
+        self.thumbnails = None
         self.toolbar_float = None
         self.toolbar = self.create_toolbar()
 
@@ -390,15 +548,13 @@ class Slides(QWidget):
         self.toolbar.setContentsMargins(0, 0, 0, 0)
 
         layout.setSpacing(0)
+        self.view_layout = layout
         layout.addWidget(self.view)
         layout.addWidget(self.toolbar)
         layout.setAlignment(self.toolbar, alignment)
         self.setLayout(layout)
         self.update_image()
 
-
-        QTimer.singleShot(0, self.resize_image)
-
         QApplication.instance().setStyleSheet("""
                     QToolTip {
                         font-family: 'Courier New', monospace;
@@ -412,9 +568,50 @@ class Slides(QWidget):
     def resized(self):
         if self.base is not None:
             self.base.setPos(0, 0)
+        self.render_timer.start()
+
+    def toggle_thumbnails(self):
+        if self.thumbnails is None:
+            # Created on first use, most lectures never open it
+            orientation = Qt.Vertical if isinstance(self.view_layout, QHBoxLayout) else Qt.Horizontal
+            self.thumbnails = ThumbnailStrip(self, orientation)
+            self.thumbnails.page_selected.connect(self.go_to)
+            self.view_layout.insertWidget(0, self.thumbnails)
+            self.thumbnails.populate()
+        self.thumbnails.setVisible(self.action_thumbnails.isChecked())
+        if self.thumbnails.isVisible():
+            self.thumbnails.set_current(self.page)
+
+    def go_to(self, index):
+        self.page = index
+        self.update_image()
+        self.view.setFocus()
+
+    def highlight(self, rects):
+        # Search hits, given in PDF points of the unrotated page, stay until the page changes
+        pdf_page = self.page_map.pdf_page(self.page)
+        if pdf_page is None:
+            return
+        matrix = self.doc[pdf_page].rotation_matrix * self.ZOOM
+        for x0, y0, x1, y1 in rects:
+            rect = fitz.Rect(x0, y0, x1, y1) * matrix
+            item = self.scene.addRect(QRectF(rect.x0, rect.y0, rect.width, rect.height),
+                                      QPen(Qt.NoPen), QColor(255, 230, 0, 110))
+            self.highlights.append(item)
+
+    def close_document(self):
+        if self.thumbnails is not None:
+            self.thumbnails.stop()
+        self.render_timer.stop()
+        self.scene.save_dirty()
+        self.annotations.stop()
+        self.indexer.stop()
+        self.renderer.stop()
+        self.cache.clear()
+        self.doc.close()
 
     def navigate(self, delta):
-        self.page = (self.page + delta) % len(self.doc)
+        self.page = (self.page + delta) % len(self.page_map)
         self.update_image()
 
     def play_program(self, program):
@@ -461,9 +658,9 @@ class Slides(QWidget):
 
     def move_to(self, right_side):
         if right_side:
-            self.page = (self.page + 1) % len(self.doc)
+            self.page = (self.page + 1) % len(self.page_map)
         else:
-            self.page = (self.page - 1) % len(self.doc)
+            self.page = (self.page - 1) % len(self.page_map)
 
         self.update_image()
 
@@ -475,117 +672,122 @@ class Slides(QWidget):
         self.view.update()
 
     def update_image(self):
-        # Clear buttons
+        # Detach the buttons of the previous page, they are kept for later visits
         for button, _ in self.code_buttons:
             self.scene.removeItem(button)
-        self.code_buttons.clear()
+        for item in self.highlights:
+            self.scene.removeItem(item)
+        self.highlights.clear()
 
         # Get number of page
-        pdf_page = self.pages_number[self.page]
+        pdf_page = self.page_map.pdf_page(self.page)
         if pdf_page is None:
-            image = QPixmap(1920, 1080)
-            image.fill(Qt.white)
+            self.code_buttons = []
         else:
-            page = self.doc[pdf_page]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), alpha=False, annots=True)
-            image = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
-            for d in page.get_drawings():
-                fill = d.get("fill")
-                type = d.get("type")
-                color = d.get("color")
-
-                if type != 'f' and color == (1.0, 0, 1.0):
-                    rect = d.get("rect")
-                    self.extract_text_and_fonts(rect)
-
+            self.code_buttons = self.get_code_buttons(pdf_page)
+            for button, _ in self.code_buttons:
+                self.scene.addItem(button)
             self.update_button_pos()
 
-        self.pixmap = QPixmap(image)
-        self.resize_image()
-        self.view.set_image(self.pixmap, self.page)
+        if self.thumbnails is not None and self.thumbnails.isVisible():
+            self.thumbnails.set_current(self.page)
+        self.refresh()
 
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        self.resize_image()
-
-    def resize_image(self):
-        # Resize the pixmap to fit the QLabel while maintaining aspect ratio
-        if not self.pixmap is None and not self.pixmap.isNull():
-            self.resized_pixmap = self.pixmap.scaled(
-                self.view.size(),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-
-    def extract_text_and_fonts(self, rect=None):
-        lines = []
-        try:
-
-            page_without_empty = 0
-            for i in range(self.page+1):
-                page_without_empty += 1 if self.pages_number[i] is not None else 0
-
-            page = self.doc[page_without_empty - 1]
-
-            # Extract blocks of text
-            blocks = page.get_text("dict", clip=rect)['blocks']
-            for block in blocks:
-                if 'lines' in block:  # Ensure the block contains text
-
-                    block_bbox = block['bbox']  # Get block position
-                    for line in block['lines']:
-                        line_text = ""
-                        line_box = line["bbox"]
-                        for span in line['spans']:
-                            text = span['text']
-                            font = span['font']
-                            position = span['bbox']  # Get position of the span
-                            line_text += text
-
-                        lines.append((line_text, line_box))
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-        if len(lines) != 0:
-            rect: Rect
-
-            xs = set()
-            for text, pos in lines:
-                x1, y1, x2, y2 = pos
-                x1 = int(x1)
-                xs.add(x1)
-            xs = list(xs)
-            xs.sort()
-
-            program = str()
-            for text, pos in lines:
-                x1, y1, x2, y2 = pos
-                x1 = int(x1)
-                i = xs.index(x1) * 4
-                program += " " * i + text + "\n"
-
-            code_pos = (rect.x0, rect.y0, rect.x1 - rect.x0, rect.y1 - rect.y0)
-
-            play_button = QPushButton()
-            play_button.setFixedSize(45, 45)
-            play_button.setIcon(self.style().standardIcon(QApplication.style().SP_MediaPlay))
-            play_button.clicked.connect(lambda x=program, y=program: self.play_program(y))
-
-            proxy = QGraphicsProxyWidget(self.scene.pixmap)
-            proxy.setWidget(play_button)
-            # proxy.setFlags(QGraphicsItem.ItemIgnoresTransformations)
-
-            # Add the proxy widget to the scene
-            # self.scene.addItem(proxy)
-
-            self.code_buttons.append((proxy, code_pos))
-            play_button.setToolTip(self.program)
+    def refresh(self):
+        self.show_page()
+        self.prerender()
+
+    def show_page(self):
+        pdf_page = self.page_map.pdf_page(self.page)
+        if pdf_page is None:
+            self.pixmap = QPixmap(1920, 1080)
+            self.pixmap.fill(Qt.white)
+            scale = 1.0
+        else:
+            zoom = self.zoom_for(pdf_page)
+            self.pixmap = self.render(pdf_page, zoom)
+            scale = self.ZOOM / zoom
+        self.view.set_image(self.pixmap, self.page_map.key(self.page), scale)
+
+    def zoom_for(self, pdf_page):
+        # Render at the device resolution of the view instead of a fixed matrix
+        size = self.view.viewport().size() * self.view.devicePixelRatioF()
+        if not self.view.isVisible() or size.isEmpty():
+            return self.ZOOM
+        rect = self.doc[pdf_page].rect
+        zoom = min(size.width() / rect.width, size.height() / rect.height)
+        # Quantized so that small resizes still hit the cache
+        return math.ceil(zoom * self.ZOOM_STEP) / self.ZOOM_STEP
+
+    def render(self, pdf_page, zoom):
+        key = (pdf_page, zoom, True)
+        pixmap = self.cache.get(key)
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(render_page(self.doc[pdf_page], zoom))
+            self.cache.put(key, pixmap)
+        return pixmap
+
+    def prerender(self):
+        # Queue the neighbouring pages, closest first, so that flipping is a cache hit
+        keys = []
+        for delta in range(1, self.PRERENDER + 1):
+            for page in [self.page + delta, self.page - delta]:
+                pdf_page = self.page_map.pdf_page(page % len(self.page_map))
+                if pdf_page is None:
+                    continue
+                key = (pdf_page, self.zoom_for(pdf_page), True)
+                if key not in self.cache and key not in keys:
+                    keys.append(key)
+        self.renderer.request(keys)
+
+    def page_rendered(self, key, image):
+        if key not in self.cache:
+            self.cache.put(key, QPixmap.fromImage(image))
+
+    def page_indexed(self, pdf_page, blocks):
+        self.code_index.setdefault(pdf_page, blocks)
+
+    def index_done(self, key):
+        self.index_key = key
+
+    def get_thumbnail(self, pdf_page):
+        if self.index_key is None:
+            return None
+        path = self.store.thumbnail_path(self.index_key, pdf_page)
+        return QImage(path) if os.path.exists(path) else None
+
+    def get_code_blocks(self, pdf_page):
+        blocks = self.code_index.get(pdf_page)
+        if blocks is None:
+            # Not reached by the indexer yet
+            blocks = extract_code_blocks(self.doc[pdf_page])
+            self.code_index[pdf_page] = blocks
+        return blocks
+
+    def get_code_buttons(self, pdf_page):
+        buttons = self.code_buttons_cache.get(pdf_page)
+        if buttons is None:
+            buttons = [(self.create_code_button(program), code_pos)
+                       for code_pos, program in self.get_code_blocks(pdf_page)]
+            self.code_buttons_cache[pdf_page] = buttons
+        return buttons
+
+    def create_code_button(self, program):
+        play_button = QPushButton()
+        play_button.setFixedSize(45, 45)
+        play_button.setIcon(self.style().standardIcon(QApplication.style().SP_MediaPlay))
+        play_button.clicked.connect(lambda x=program, y=program: self.play_program(y))
+        play_button.setToolTip(program)
+
+        proxy = QGraphicsProxyWidget()
+        proxy.setWidget(play_button)
+        # proxy.setFlags(QGraphicsItem.ItemIgnoresTransformations)
+        return proxy
 
     def update_button_pos(self):
 
         for button, code_pos in self.code_buttons:
             code_x, code_y, code_w, code_h = code_pos
             button: QGraphicsRectItem
-            button.setPos((code_x + code_w) * 2 - button.sceneBoundingRect().width(),
-                          (code_y + code_h) * 2 - button.sceneBoundingRect().height())
+            button.setPos((code_x + code_w) * self.ZOOM - button.sceneBoundingRect().width(),
+                          (code_y + code_h) * self.ZOOM - button.sceneBoundingRect().height())
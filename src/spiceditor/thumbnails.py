@@ -0,0 +1,124 @@
+from PyQt5.QtCore import Qt, QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QIcon, QPixmap
+from PyQt5.QtWidgets import QListWidget, QListWidgetItem, QListView
+
+from spiceditor.page_cache import PageRenderer
+from spiceditor.slide_index import THUMBNAIL_WIDTH
+
+
+class ThumbnailStrip(QListWidget):
+    """Strip of page thumbnails of a Slides widget.
+
+    Thumbnails come from the slide index on disk or from pages already in the
+    render cache when possible. The others are rendered in the background,
+    visible ones first; scrolling away replaces the pending requests.
+    """
+
+    page_selected = pyqtSignal(int)
+
+    MARGIN = 4
+    DELAY = 50
+
+    def __init__(self, slides, orientation=Qt.Vertical):
+        super().__init__()
+        self.slides = slides
+        self.icons = {}
+        self.setViewMode(QListView.ListMode)
+        self.setFlow(QListView.TopToBottom if orientation == Qt.Vertical else QListView.LeftToRight)
+        self.setWrapping(False)
+        self.setUniformItemSizes(True)
+        self.setIconSize(QSize(THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 3 // 4))
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        if orientation == Qt.Vertical:
+            self.setFixedWidth(THUMBNAIL_WIDTH + 40)
+        else:
+            self.setFixedHeight(THUMBNAIL_WIDTH * 3 // 4 + 40)
+
+        self.blank = QPixmap(THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 9 // 16)
+        self.blank.fill(Qt.white)
+
+        self.renderer = PageRenderer(slides.filename)
+        self.renderer.rendered.connect(self.thumbnail_rendered)
+        self.renderer.start()
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DELAY)
+        self.timer.timeout.connect(self.update_visible)
+        self.verticalScrollBar().valueChanged.connect(self.timer.start)
+        self.horizontalScrollBar().valueChanged.connect(self.timer.start)
+        self.itemClicked.connect(lambda item: self.page_selected.emit(self.row(item)))
+
+    def stop(self):
+        self.renderer.stop()
+
+    def populate(self):
+        self.clear()
+        page_map = self.slides.page_map
+        for index in range(len(page_map)):
+            pdf_page = page_map.pdf_page(index)
+            item = QListWidgetItem(str(index + 1))
+            if pdf_page is None:
+                item.setIcon(QIcon(self.blank))
+            elif pdf_page in self.icons:
+                item.setIcon(self.icons[pdf_page])
+            self.addItem(item)
+        self.set_current(self.slides.page)
+        self.timer.start()
+
+    def set_current(self, index):
+        self.blockSignals(True)
+        self.setCurrentRow(index)
+        self.blockSignals(False)
+        self.scrollToItem(self.item(index), QListView.EnsureVisible)
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        self.timer.start()
+
+    def resizeEvent(self, e):
+        super().resizeEvent(e)
+        self.timer.start()
+
+    def visible_rows(self):
+        rect = self.viewport().rect()
+        first = self.indexAt(rect.topLeft())
+        last = self.indexAt(rect.bottomRight())
+        first = first.row() if first.isValid() else 0
+        last = last.row() if last.isValid() else self.count() - 1
+        return range(max(0, first - self.MARGIN), min(self.count(), last + self.MARGIN + 1))
+
+    def find_thumbnail(self, pdf_page):
+        image = self.slides.get_thumbnail(pdf_page)
+        if image is not None and not image.isNull():
+            return QPixmap.fromImage(image)
+        pixmap = self.slides.cache.find(pdf_page)
+        if pixmap is not None:
+            return pixmap.scaledToWidth(THUMBNAIL_WIDTH, Qt.SmoothTransformation)
+        return None
+
+    def update_visible(self):
+        if not self.isVisible():
+            return
+        keys = []
+        for row in self.visible_rows():
+            pdf_page = self.slides.page_map.pdf_page(row)
+            if pdf_page is None or pdf_page in self.icons:
+                continue
+            pixmap = self.find_thumbnail(pdf_page)
+            if pixmap is not None:
+                self.set_icon(pdf_page, pixmap)
+            else:
+                zoom = THUMBNAIL_WIDTH / self.slides.doc[pdf_page].rect.width
+                keys.append((pdf_page, zoom, False))
+        # Pages scrolled away from are dropped from the queue
+        self.renderer.request(keys)
+
+    def set_icon(self, pdf_page, pixmap):
+        self.icons[pdf_page] = QIcon(pixmap)
+        index = self.slides.page_map.index_of(pdf_page)
+        if index < self.count():
+            self.item(index).setIcon(self.icons[pdf_page])
+
+    def thumbnail_rendered(self, key, image):
+        self.set_icon(key[0], QPixmap.fromImage(image))
@@ -0,0 +1,60 @@
+import threading
+
+from PyQt5.QtCore import QThread
+
+
+class QueueWorker(QThread):
+    """A thread processing queued jobs one at a time until stopped.
+
+    Jobs are queued by key, queuing a key again replaces its job. Subclasses
+    implement process(key, job). On stop() the queued jobs are dropped, or
+    still processed before the thread ends if DRAIN_ON_STOP is set; either
+    way stop() waits for the thread.
+    """
+
+    DRAIN_ON_STOP = False
+
+    def __init__(self):
+        super().__init__()
+        self.pending = {}
+        self.running = True
+        self.condition = threading.Condition()
+
+    def put(self, key, job=None):
+        with self.condition:
+            self.pending.pop(key, None)
+            self.pending[key] = job
+            self.condition.notify()
+
+    def replace(self, jobs):
+        # The queue becomes the given {key: job}, in order
+        with self.condition:
+            self.pending = dict(jobs)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            if not self.DRAIN_ON_STOP:
+                self.pending.clear()
+            self.condition.notify()
+        self.wait()
+
+    def next_job(self):
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            key = next(iter(self.pending))
+            return key, self.pending.pop(key)
+
+    def process(self, key, job):
+        raise NotImplementedError
+
+    def run(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                break
+            self.process(*job)